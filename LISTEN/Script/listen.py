@@ -1,8 +1,14 @@
 import os
+import re
 import threading
 import queue
 import pickle
 import io
+import hashlib
+import posixpath
+import zipfile
+import concurrent.futures
+import xml.etree.ElementTree as ET
 from pydub import AudioSegment
 import time
 import whisper
@@ -11,6 +17,18 @@ import librosa
 import pygame
 from pynput import keyboard
 
+PPTX_NS = {
+    'p': 'http://schemas.openxmlformats.org/presentationml/2006/main',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+}
+PPTX_AUDIO_EXTENSIONS = {'.mp3', '.m4a', '.wav', '.wma', '.aac', '.ogg', '.flac'}
+
+# Sentences are stored, stretched, cached and played in this format. 'source' keeps the original audio.
+PROCESSING_PROFILES = {
+    'source': None,
+    'speech': {'frame_rate': 22050, 'channels': 1, 'sample_width': 2},
+}
+
 def play_audio(segment):
     buffer = io.BytesIO()
     segment.export(buffer, format="wav")
@@ -68,42 +86,200 @@ def input_collector(q):
     with keyboard.Listener(on_press=on_press) as listener:
         listener.join()
 
-def sentence_listening_practice(filepath, repeat_times=3, whisper_model="base"):
+def apply_processing_profile(audio, profile='speech'):
+    settings = PROCESSING_PROFILES[profile]
+    if settings is None:
+        return audio
+    if audio.channels != settings['channels']:
+        audio = audio.set_channels(settings['channels'])
+    if audio.frame_rate != settings['frame_rate']:
+        audio = audio.set_frame_rate(settings['frame_rate'])
+    if audio.sample_width != settings['sample_width']:
+        audio = audio.set_sample_width(settings['sample_width'])
+    return audio
+
+def report_profile_saving(source, processed, profile):
+    source_rate = source.frame_rate * source.channels * source.sample_width
+    processed_rate = processed.frame_rate * processed.channels * processed.sample_width
+    if processed_rate >= source_rate:
+        return
+    seconds = len(source) / 1000.0
+    print(f"Processing profile '{profile}': {source.frame_rate} Hz/{source.channels} ch -> "
+          f"{processed.frame_rate} Hz/{processed.channels} ch, "
+          f"{source_rate * seconds / 1e6:.1f} MB -> {processed_rate * seconds / 1e6:.1f} MB "
+          f"({source_rate / processed_rate:.1f}x less memory and stretch work per sentence).")
+
+def profile_cache_path(filepath, whisper_model, profile):
+    if profile == 'source':
+        return f"{filepath}.{whisper_model}.whisper.cache"
+    return f"{filepath}.{whisper_model}.{profile}.whisper.cache"
+
+def build_sentences(audio, result):
+    sentences_data = []
+    for segment in result["segments"]:
+        start_ms = int(segment['start'] * 1000)
+        end_ms = int(segment['end'] * 1000)
+        text = segment['text'].strip()
+        if not text: continue
+
+        audio_segment = audio[start_ms:end_ms]
+        sentences_data.append({'audio': audio_segment, 'text': text})
+    return sentences_data
+
+def load_sentences(filepath, whisper_model="base", profile='speech'):
+    cache_filepath = profile_cache_path(filepath, whisper_model, profile)
+
+    if os.path.exists(cache_filepath):
+        print(f"Whisper cache file detected. Loading from '{cache_filepath}'...")
+        with open(cache_filepath, 'rb') as f:
+            sentences_data = pickle.load(f)
+        print("Successfully loaded from cache!")
+        return sentences_data
+
+    source_cache_filepath = profile_cache_path(filepath, whisper_model, 'source')
+    if os.path.exists(source_cache_filepath):
+        print(f"Converting existing cache '{source_cache_filepath}' to the '{profile}' profile...")
+        with open(source_cache_filepath, 'rb') as f:
+            sentences_data = pickle.load(f)
+        if sentences_data:
+            report_profile_saving(sentences_data[0]['audio'], apply_processing_profile(sentences_data[0]['audio'], profile), profile)
+        for sentence in sentences_data:
+            sentence['audio'] = apply_processing_profile(sentence['audio'], profile)
+        with open(cache_filepath, 'wb') as f:
+            pickle.dump(sentences_data, f)
+        return sentences_data
+
+    print("Cache not found. Analyzing audio with Whisper on first run.")
+    print(f"Loading Whisper model '{whisper_model}'...")
+    model = whisper.load_model(whisper_model)
+    print("Model loaded. Transcribing audio, please wait...")
+    result = model.transcribe(filepath, language="ja")
+
+    print("Transcription complete. Splitting audio by timestamps...")
+    source_audio = AudioSegment.from_file(filepath)
+    audio = apply_processing_profile(source_audio, profile)
+    report_profile_saving(source_audio, audio, profile)
+    sentences_data = build_sentences(audio, result)
+
+    if sentences_data:
+        print(f"Splitting complete! Creating cache file '{cache_filepath}' for faster startup next time.")
+        with open(cache_filepath, 'wb') as f:
+            pickle.dump(sentences_data, f)
+    return sentences_data
+
+def natural_key(s):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', s)]
+
+def iter_pptx_audio_parts(pptx_path):
+    # Walks the slides in presentation order and yields every embedded audio part
+    # as (slide_number, part_name, bytes), reading straight from the zip.
+    with zipfile.ZipFile(pptx_path) as zf:
+        names = set(zf.namelist())
+
+        def read_rels(part_name):
+            folder, base = posixpath.split(part_name)
+            rels_name = posixpath.join(folder, '_rels', base + '.rels')
+            if rels_name not in names:
+                return {}
+            rels = {}
+            for rel in ET.fromstring(zf.read(rels_name)):
+                if rel.get('TargetMode') == 'External':
+                    continue
+                target = posixpath.normpath(posixpath.join(folder, rel.get('Target')))
+                rels[rel.get('Id')] = (rel.get('Type', ''), target)
+            return rels
+
+        presentation_rels = read_rels('ppt/presentation.xml')
+        presentation = ET.fromstring(zf.read('ppt/presentation.xml'))
+        slide_parts = []
+        for sld_id in presentation.iter(f"{{{PPTX_NS['p']}}}sldId"):
+            rel = presentation_rels.get(sld_id.get(f"{{{PPTX_NS['r']}}}id"))
+            if rel:
+                slide_parts.append(rel[1])
+
+        seen_parts = set()
+        for slide_number, slide_part in enumerate(slide_parts, start=1):
+            for rel_id, (rel_type, target) in sorted(read_rels(slide_part).items(), key=lambda item: natural_key(item[0])):
+                if not rel_type.endswith(('/audio', '/media')):
+                    continue
+                if posixpath.splitext(target)[1].lower() not in PPTX_AUDIO_EXTENSIONS:
+                    continue
+                if target in seen_parts or target not in names:
+                    continue
+                seen_parts.add(target)
+                with zf.open(target) as f:
+                    yield slide_number, target, f.read()
+
+def transcribe_clip(model, model_lock, data, fmt, profile='speech'):
+    source_audio = AudioSegment.from_file(io.BytesIO(data), format=fmt)
+    whisper_input = source_audio.set_frame_rate(16000).set_channels(1).set_sample_width(2)
+    samples = np.frombuffer(whisper_input.raw_data, dtype=np.int16).astype(np.float32) / 32768.0
+    # A single Whisper model is shared by all workers; decoding and cache I/O run in parallel.
+    with model_lock:
+        result = model.transcribe(samples, language="ja")
+    audio = apply_processing_profile(source_audio, profile)
+    report_profile_saving(source_audio, audio, profile)
+    return build_sentences(audio, result)
+
+def load_pptx_sentences(pptx_path, whisper_model="base", profile='speech', max_workers=4):
+    cache_dir = f"{pptx_path}.cache"
+    os.makedirs(cache_dir, exist_ok=True)
+
+    model_state = {'model': None}
+    model_lock = threading.Lock()
+
+    def get_model():
+        with model_lock:
+            if model_state['model'] is None:
+                print(f"Loading Whisper model '{whisper_model}'...")
+                model_state['model'] = whisper.load_model(whisper_model)
+            return model_state['model']
+
+    def process_clip(digest, part_name, data):
+        cache_filepath = profile_cache_path(os.path.join(cache_dir, digest), whisper_model, profile)
+        if os.path.exists(cache_filepath):
+            with open(cache_filepath, 'rb') as f:
+                return pickle.load(f)
+        print(f"Transcribing '{part_name}'...")
+        fmt = posixpath.splitext(part_name)[1].lstrip('.').lower()
+        sentences_data = transcribe_clip(get_model(), model_lock, data, fmt, profile)
+        if sentences_data:
+            tmp_path = cache_filepath + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(sentences_data, f)
+            os.replace(tmp_path, cache_filepath)
+        return sentences_data
+
+    playlist = []
+    clips = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for slide_number, part_name, data in iter_pptx_audio_parts(pptx_path):
+            digest = hashlib.sha1(data).hexdigest()
+            if digest in clips:
+                print(f"Slide {slide_number}: '{part_name}' is identical to an earlier clip, skipping.")
+                continue
+            clips[digest] = executor.submit(process_clip, digest, part_name, data)
+            playlist.append(digest)
+        print(f"Found {len(playlist)} unique audio clip(s) in '{os.path.basename(pptx_path)}'.")
+
+        sentences_data = []
+        for digest in playlist:
+            try:
+                sentences_data.extend(clips[digest].result())
+            except Exception as e:
+                print(f"!! Failed to process audio clip {digest[:8]}: {e}")
+    return sentences_data
+
+def sentence_listening_practice(filepath, repeat_times=3, whisper_model="base", profile='speech'):
     if not os.path.exists(filepath):
         print(f"Error: Audio file not found at '{filepath}'")
         return
 
     try:
-        cache_filepath = f"{filepath}.{whisper_model}.whisper.cache"
-        
-        if os.path.exists(cache_filepath):
-            print(f"Whisper cache file detected. Loading from '{cache_filepath}'...")
-            with open(cache_filepath, 'rb') as f:
-                sentences_data = pickle.load(f)
-            print("Successfully loaded from cache!")
+        if filepath.lower().endswith('.pptx'):
+            sentences_data = load_pptx_sentences(filepath, whisper_model, profile)
         else:
-            print("Cache not found. Analyzing audio with Whisper on first run.")
-            print(f"Loading Whisper model '{whisper_model}'...")
-            model = whisper.load_model(whisper_model)
-            print("Model loaded. Transcribing audio, please wait...")
-            result = model.transcribe(filepath, language="ja")
-            
-            print("Transcription complete. Splitting audio by timestamps...")
-            audio = AudioSegment.from_file(filepath)
-            sentences_data = []
-            for segment in result["segments"]:
-                start_ms = int(segment['start'] * 1000)
-                end_ms = int(segment['end'] * 1000)
-                text = segment['text'].strip()
-                if not text: continue
-                
-                audio_segment = audio[start_ms:end_ms]
-                sentences_data.append({'audio': audio_segment, 'text': text})
-            
-            if sentences_data:
-                print(f"Splitting complete! Creating cache file '{cache_filepath}' for faster startup next time.")
-                with open(cache_filepath, 'wb') as f:
-                    pickle.dump(sentences_data, f)
+            sentences_data = load_sentences(filepath, whisper_model, profile)
 
         if not sentences_data:
             print("Could not detect any sentences in the audio.")
@@ -112,8 +288,10 @@ def sentence_listening_practice(filepath, repeat_times=3, whisper_model="base"):
         print(f"Audio successfully split into {len(sentences_data)} sentences.")
         print("\n*** IMPORTANT: If you change the audio file or the Whisper model, please delete the .cache file manually. ***")
 
+        first_audio = sentences_data[0]['audio']
         pygame.init()
-        pygame.mixer.init()
+        # Match the mixer to the stored format so playback does not resample every sentence.
+        pygame.mixer.init(frequency=first_audio.frame_rate, channels=first_audio.channels)
 
         command_queue = queue.Queue()
         input_thread = threading.Thread(target=input_collector, args=(command_queue,), daemon=True)
@@ -199,9 +377,11 @@ def sentence_listening_practice(filepath, repeat_times=3, whisper_model="base"):
 
 if __name__ == '__main__':
     audio_file = './21_7/5_1.mp3'
+    # Lesson decks can be used directly, e.g. audio_file = '../2_22_12.pptx'
     sentence_listening_practice(
         filepath=audio_file, 
         repeat_times=5,
-        whisper_model="base"
+        whisper_model="base",
+        profile='speech'
     )
 
@@ -0,0 +1,241 @@
+import argparse
+import concurrent.futures
+import contextlib
+import heapq
+import importlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from openpyxl import Workbook, load_workbook
+
+# Benchmarks the study engine behind WORD/word.py, GRAMMAR/grammar.py and LISTEN/Script/review.py on synthetic decks:
+#   python benchmark.py [--sizes 1000,10000,100000] [--output bench.json]
+# Speech is never played and the keyboard is replaced by a scripted key sequence.
+
+SHEETS_PER_DECK = 4
+LOOP_CARDS = 2000
+SAVE_CARDS = 500
+COLUMN_WIDTHS = {'A': 6, 'B': 18, 'C': 22, 'D': 30, 'E': 26}
+HIRAGANA = [chr(code) for code in range(0x3041, 0x3094)]
+KANJI = [chr(code) for code in range(0x4E00, 0x4E00 + 2000)]
+
+
+def load_study_engine(workdir):
+    # The engine exits when `keyboard` is missing, and it needs root on Linux anyway, so a
+    # stand-in module is installed before importing. Keys are fed by BenchKeyBuffer instead.
+    if 'keyboard' not in sys.modules:
+        keyboard = types.ModuleType('keyboard')
+        keyboard.KEY_DOWN = 'down'
+        keyboard.hook = lambda callback, suppress=False: callback
+        keyboard.unhook = lambda hook: None
+        sys.modules['keyboard'] = keyboard
+    with contextlib.redirect_stdout(io.StringIO()):
+        module = importlib.import_module('study_engine')
+    # Nothing may be synthesized or played during a run.
+    module.gtts_available = False
+    module.pyttsx3_available = False
+    module.audio_playback_available = False
+    # Scripted sessions are not study sessions; their metrics stay out of the learner's study_metrics.jsonl.
+    module.METRICS_PATH = os.path.join(workdir, 'study_metrics.jsonl')
+    return module
+
+
+def make_bench_key_buffer(keys, times):
+    class BenchKeyBuffer:
+        # Hands out a fixed key sequence and notes when the loop asked for its first and its last key.
+        def start(self):
+            self.keys = iter(keys)
+
+        def get(self):
+            times.setdefault('first', time.perf_counter())
+            self.last_time = time.perf_counter()
+            key = next(self.keys, 'q')
+            if key == 'q':
+                times['last'] = time.perf_counter()
+            return key
+
+        def stop(self):
+            pass
+
+    return BenchKeyBuffer
+
+
+def random_text(rng, alphabet, low, high):
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(low, high)))
+
+
+def generate_workbook(path, rows, seed=0):
+    rng = random.Random(seed)
+    book = Workbook()
+    book.remove(book.active)
+    per_sheet = -(-rows // SHEETS_PER_DECK)
+    for index in range(SHEETS_PER_DECK):
+        ws = book.create_sheet(f"S{index + 1}")
+        ws.append(['Fre', '单词', '读音', '含义', '备注'])
+        for _ in range(min(per_sheet, rows - index * per_sheet)):
+            word = random_text(rng, KANJI, 1, 3) + random_text(rng, HIRAGANA, 0, 2)
+            # About half of the words come without a reading, so kakasi has work to do.
+            reading = random_text(rng, HIRAGANA, 2, 6) if rng.random() < 0.5 else None
+            ws.append([rng.randint(0, 5), word, reading, random_text(rng, KANJI, 2, 8),
+                       random_text(rng, HIRAGANA, 0, 10) or None])
+        for column, width in COLUMN_WIDTHS.items():
+            ws.column_dimensions[column].width = width
+    book.save(path)
+
+
+def column_widths(path):
+    book = load_workbook(path, read_only=False)
+    widths = {name: {column: book[name].column_dimensions[column].width for column in COLUMN_WIDTHS}
+              for name in book.sheetnames}
+    book.close()
+    return widths
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_scripted_session(study, path, keys):
+    # One session over every sheet with the given keys; returns the loop time per answered card.
+    # The session closes the deck store when it ends, so it gets one of its own.
+    store = study.DeckStore(path)
+    times = {}
+    study.KeyBuffer = make_bench_key_buffer(keys, times)
+    voice_future = concurrent.futures.Future()
+    voice_future.set_result(None)
+    sources = [study.DeckSource(store, name) for name in store.sheet_names()]
+    with contextlib.redirect_stdout(io.StringIO()):
+        study.run_session(sources, 'offline', voice_future, study.StartupTimer())
+    answers = sum(1 for key in keys if key in ('right', '0'))
+    return (times['last'] - times['first']) / answers
+
+
+def measure_kakasi_init():
+    # pykakasi keeps its dictionaries for the life of the process, so only the first get_kakasi() in
+    # a process pays for loading them. It is timed once, in a fresh interpreter, as a session would see it.
+    code = ("import time, pykakasi\n"
+            "started = time.perf_counter()\n"
+            "pykakasi.kakasi().convert('日本語')\n"
+            "print(time.perf_counter() - started)\n")
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    return round(float(output), 3)
+
+
+def bench_size(study, workdir, rows, loop_cards):
+    result = {'rows': rows, 'sheets': SHEETS_PER_DECK}
+    path = os.path.join(workdir, f"deck_{rows}.xlsx")
+
+    started = time.perf_counter()
+    generate_workbook(path, rows)
+    result['generate_s'] = round(time.perf_counter() - started, 3)
+    result['file_mb'] = round(os.path.getsize(path) / (1024 * 1024), 2)
+
+    store = study.DeckStore(path)
+    started = time.perf_counter()
+    store.import_workbook()
+    result['load_s'] = round(time.perf_counter() - started, 3)
+
+    sources = [study.DeckSource(store, name) for name in store.sheet_names()]
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for source in sources:
+            source.prepare()
+    result['readings_s'] = round(time.perf_counter() - started, 3)
+    result['readings_generated'] = store.conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+
+    # Everything a session does to put the due cards of all sheets in order, for the whole deck.
+    now = time.time()
+    started = time.perf_counter()
+    total = sum(source.count_due(now) for source in sources)
+    merged = heapq.merge(*(source.cards(now) for source in sources), key=lambda card: (card.due, -card.fre))
+    queue = study.StudyQueue(merged, total)
+    while queue.pop() is not None:
+        pass
+    result['sort_s'] = round(time.perf_counter() - started, 3)
+
+    # Each session answers a quarter of the deck at most, so the next one still finds due cards.
+    cards = min(loop_cards, rows // 4)
+    result['loop_cards'] = cards
+    store.close()
+    per_card = run_scripted_session(study, path, ['right'] * cards)
+    result['loop_per_card_ms'] = round(per_card * 1000, 3)
+    # 'right' then 'x' answers a card and corrects it; the difference to the plain loop is the correction.
+    per_pair = run_scripted_session(study, path, ['right', 'x'] * cards)
+    result['x_correction_ms'] = round(max(per_pair - per_card, 0) * 1000, 3)
+
+    # The save path: Fre deltas for some cards merged into the workbook, column widths kept.
+    widths = column_widths(path)
+    store = study.DeckStore(path)
+    rng = random.Random(1)
+    for sheet, row in rng.sample(store.conn.execute("SELECT sheet, row FROM cards").fetchall(), min(SAVE_CARDS, rows)):
+        store.record(sheet, row, 'forgot', 1)
+    exporter = study.WorkbookExporter(path)
+    started = time.perf_counter()
+    saved = exporter.export()
+    result['save_s'] = round(time.perf_counter() - started, 3)
+    exporter.store.close()
+    result['save_cards'] = min(SAVE_CARDS, rows)
+    result['saved'] = bool(saved)
+    result['widths_preserved'] = column_widths(path) == widths
+
+    store.close()
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the study engine on synthetic decks.")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="comma separated row counts")
+    parser.add_argument('--loop-cards', type=int, default=LOOP_CARDS, help="cards answered per scripted session")
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    parser.add_argument('--keep', action='store_true', help="keep the generated decks")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='study_bench_')
+    study = load_study_engine(workdir)
+    # Loaded up front, so that readings_s does not include it for the first size only.
+    study.get_kakasi()
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'kakasi_init_s': measure_kakasi_init(),
+        'results': [],
+    }
+    try:
+        for rows in [int(size) for size in args.sizes.split(',')]:
+            print(f"Benchmarking {rows} rows...", file=sys.stderr)
+            report['results'].append(bench_size(study, workdir, rows, args.loop_cards))
+    finally:
+        if args.keep:
+            print(f"Decks kept in '{workdir}'.", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+
+
+if __name__ == '__main__':
+    main()
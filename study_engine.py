@@ -0,0 +1,2412 @@
+# The study engine shared by WORD/word.py, GRAMMAR/grammar.py and LISTEN/Script/review.py.
+# Those scripts only hold their defaults (workbook, sheet, TTS mode, readings) and call run_cli().
+import pandas as pd
+import numpy as np
+import os
+import sys
+import io
+import json
+import mmap
+import heapq
+import struct
+import hashlib
+import bisect
+import sqlite3
+import queue
+import threading
+from collections import deque, namedtuple
+from openpyxl import load_workbook
+from openpyxl.packaging.custom import IntProperty
+import tempfile
+import shutil
+import time
+import contextlib
+import concurrent.futures
+import importlib.metadata
+import http.server
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+try:
+    import keyboard
+except ImportError:
+    print("Error: 'keyboard' library is missing.")
+    print("Please run in your terminal or command line: pip install keyboard")
+    sys.exit()
+
+# New library for Japanese character conversion
+try:
+    import pykakasi
+except ImportError:
+    print("Error: 'pykakasi' library is missing.")
+    print("Please run in your terminal or command line: pip install pykakasi")
+    sys.exit()
+
+# The speech libraries are slow to import, so load_tts_backends() imports them in the background.
+gtts_available = False
+pyttsx3_available = False
+playsound_available = False
+pygame_available = False
+audio_playback_available = False
+tts_backends_lock = threading.Lock()
+tts_backends_loaded = False
+
+
+def load_tts_backends():
+    global gTTS, playsound, pyttsx3, pygame
+    global gtts_available, pyttsx3_available, playsound_available, pygame_available, audio_playback_available
+    global tts_backends_loaded
+    with tts_backends_lock:
+        if tts_backends_loaded:
+            return
+        try:
+            from gtts import gTTS
+            from playsound import playsound
+            gtts_available = True
+        except ImportError:
+            print("Warning: gTTS or playsound library not installed. Online TTS function will be unavailable.")
+            print("  - pip install gTTS")
+            print("  - pip install playsound==1.2.2")
+            gtts_available = False
+
+        try:
+            import pyttsx3
+            pyttsx3_available = True
+        except ImportError:
+            print("Warning: pyttsx3 library not installed. Offline backup TTS function will be unavailable.")
+            print("  - pip install pyttsx3")
+            pyttsx3_available = False
+
+        try:
+            from playsound import playsound
+            playsound_available = True
+        except ImportError:
+            playsound_available = False
+
+        # pygame is optional; when present it plays speech in a way that can be cut off mid-word.
+        os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+        try:
+            import pygame
+            pygame_available = True
+        except ImportError:
+            pygame_available = False
+
+        audio_playback_available = pygame_available or playsound_available
+        tts_backends_loaded = True
+
+
+def probe_tts_backends():
+    load_tts_backends()
+    return get_pyttsx3_japanese_voice_id()
+
+
+TTS_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tts_config.json')
+TTS_CONFIG_MAX_AGE = 7 * 86400
+TTS_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tts_cache')
+DECK_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deck_catalog.json')
+TTS_CACHE_MAX_BYTES = 200 * 1024 * 1024
+PREFETCH_DEPTH = 3
+AUDIO_PACK_MAGIC = b'JSHPACK1'
+AUDIO_PACK_HEADER = struct.Struct('<8sQQ')
+GTTS_MAX_CONCURRENCY = 4
+FILE_LOCK_TIMEOUT = 60.0
+SQLITE_BUSY_TIMEOUT = 30.0
+METRICS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'study_metrics.jsonl')
+METRICS_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class Metrics:
+    # Counters and latency histograms for one session, updated from the study loop and the speech threads.
+    # Histograms use fixed millisecond buckets (the last one is open-ended) so sessions can be compared.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        ms = seconds * 1000
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = {'count': 0, 'sum_ms': 0.0, 'max_ms': 0.0,
+                                                     'buckets': [0] * (len(METRICS_BUCKETS_MS) + 1)}
+            histogram['count'] += 1
+            histogram['sum_ms'] += ms
+            histogram['max_ms'] = max(histogram['max_ms'], ms)
+            histogram['buckets'][bisect.bisect_left(METRICS_BUCKETS_MS, ms)] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {'buckets_ms': list(METRICS_BUCKETS_MS), 'counters': dict(self.counters),
+                    'histograms': {name: {**histogram, 'buckets': list(histogram['buckets'])}
+                                   for name, histogram in self.histograms.items()}}
+
+    def write(self, **details):
+        # One JSON line per session, appended to the local metrics file.
+        try:
+            with open(METRICS_PATH, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'time': time.time(), **details, **self.snapshot()}, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"!! Could not write metrics to '{METRICS_PATH}': {e}")
+
+
+metrics = Metrics()
+
+
+def serve_metrics(port):
+    # Serves the running session's metrics as JSON on http://127.0.0.1:<port>/metrics.
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Pyttsx3Worker(threading.Thread):
+    # Owns a single pyttsx3 engine for the whole session and serves utterances from a queue,
+    # so the engine is initialized once instead of for every card.
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.jobs = queue.Queue()
+        self.ready = threading.Event()
+        self.engine = None
+        self.voices = []
+        self.init_error = None
+        self.current_voice = None
+        self.generation = 0
+        self.job_generation = 0
+
+    def run(self):
+        try:
+            if sys.platform == 'win32':
+                # SAPI5 is a COM server and every thread using it has to initialize COM.
+                import comtypes
+                comtypes.CoInitialize()
+            self.engine = pyttsx3.init()
+            self.voices = self.engine.getProperty('voices')
+            self.engine.connect('started-word', self.on_word)
+        except Exception as e:
+            self.init_error = e
+        finally:
+            self.ready.set()
+
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            kind, voice_id, text, path, generation, done, result = job
+            try:
+                if self.engine is None:
+                    raise RuntimeError(f"pyttsx3 engine failed to start: {self.init_error}")
+                if generation is not None and generation != self.generation:
+                    result['cancelled'] = True
+                    continue
+                self.job_generation = generation
+                if voice_id != self.current_voice:
+                    self.engine.setProperty('voice', voice_id)
+                    self.current_voice = voice_id
+                if kind == 'say':
+                    self.engine.say(text)
+                else:
+                    self.engine.save_to_file(text, path)
+                self.engine.runAndWait()
+                # A 'say' that cancel() stopped at a word boundary did not finish.
+                result['cancelled'] = generation is not None and generation != self.generation
+                result['ok'] = not result['cancelled']
+            except Exception as e:
+                result['error'] = e
+            finally:
+                done.set()
+
+    def on_word(self, name, location, length):
+        if self.job_generation is not None and self.job_generation != self.generation:
+            self.engine.stop()
+
+    def submit(self, kind, voice_id, text, path=None):
+        # Renders carry no generation: they always run to the end, since a cut-off file would be cached for good.
+        done = threading.Event()
+        result = {'ok': False, 'cancelled': False, 'error': None}
+        generation = self.generation if kind == 'say' else None
+        self.jobs.put((kind, voice_id, text, path, generation, done, result))
+        return done, result
+
+    def wait(self, done, result):
+        done.wait()
+        if result['error'] is not None:
+            raise result['error']
+        return result['ok']
+
+    def say(self, voice_id, text):
+        return self.wait(*self.submit('say', voice_id, text))
+
+    def render(self, voice_id, text, path):
+        return self.wait(*self.submit('render', voice_id, text, path))
+
+    def cancel(self):
+        # Stops the utterance being spoken at its next word and drops the ones still queued.
+        self.generation += 1
+
+    def list_voices(self):
+        self.ready.wait()
+        if self.init_error is not None:
+            raise self.init_error
+        return self.voices
+
+
+pyttsx3_worker = None
+
+
+def get_pyttsx3_worker():
+    global pyttsx3_worker
+    if pyttsx3_worker is None:
+        pyttsx3_worker = Pyttsx3Worker()
+        pyttsx3_worker.start()
+    return pyttsx3_worker
+
+
+def tts_config_fingerprint():
+    # Cheap to compute: no engine is started and nothing is imported.
+    try:
+        pyttsx3_version = importlib.metadata.version('pyttsx3')
+    except importlib.metadata.PackageNotFoundError:
+        pyttsx3_version = None
+    return {'platform': sys.platform, 'pyttsx3': pyttsx3_version}
+
+
+def load_cached_voice_id():
+    try:
+        with open(TTS_CONFIG_PATH, encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return False, None
+    if config.get('fingerprint') != tts_config_fingerprint() or time.time() - config.get('time', 0) > TTS_CONFIG_MAX_AGE:
+        return False, None
+    # Only a voice that was found is cached, so a missing one is looked for again on every start.
+    voice_id = config.get('voice_id')
+    return bool(voice_id), voice_id
+
+
+def save_cached_voice_id(voice_id):
+    config = {
+        'fingerprint': tts_config_fingerprint(),
+        'time': time.time(),
+        'voice_id': voice_id,
+    }
+    try:
+        with open(TTS_CONFIG_PATH, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        print(f"!! Could not write TTS config '{TTS_CONFIG_PATH}': {e}")
+
+
+def forget_cached_voice_id():
+    if os.path.exists(TTS_CONFIG_PATH):
+        os.remove(TTS_CONFIG_PATH)
+
+
+def get_pyttsx3_japanese_voice_id():
+    if not pyttsx3_available:
+        return None
+    found, cached_voice_id = load_cached_voice_id()
+    if found:
+        print("\nUsing cached [Local] Japanese voice ID. Offline backup is available.")
+        return cached_voice_id
+    try:
+        voices = get_pyttsx3_worker().list_voices()
+
+        japanese_voice_id = None
+        for voice in voices:
+            lang_str = getattr(voice, 'lang', '').lower()
+            name_str = getattr(voice, 'name', '').lower()
+            if 'ja' in lang_str or 'japanese' in name_str:
+                japanese_voice_id = voice.id
+                break
+        
+        if japanese_voice_id:
+            save_cached_voice_id(japanese_voice_id)
+            print("\nSuccessfully found [Local] Japanese voice ID. Offline backup is available.")
+            return japanese_voice_id
+        else:
+            print("\nWarning: Japanese [Local] voice package not found in your system. Offline backup may not work.")
+            return None
+    except Exception as e:
+        print(f"\nFailed to scan for local voices: {e}")
+        return None
+
+
+def tts_cache_path(engine, voice, lang, text, suffix):
+    # Content-addressed: the same (engine, voice, language, text) always maps to the same file.
+    key = hashlib.sha256(json.dumps([engine, voice, lang, text], ensure_ascii=False).encode('utf-8')).hexdigest()
+    return os.path.join(TTS_CACHE_DIR, key[:2], key + suffix)
+
+
+def tts_cache_lookup(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        # The modification time doubles as the LRU timestamp.
+        os.utime(path)
+    except OSError:
+        pass
+    return path
+
+
+tts_cache_bytes = None
+tts_cache_unchecked_bytes = 0
+tts_cache_lock = threading.Lock()
+
+
+def tts_cache_store(temp_path, path):
+    # The cache size is counted once and then kept as a running total, so storing a clip does not
+    # walk the whole cache. Other processes store into it too, so it is recounted after every
+    # tenth of the budget this process adds, or when the total says it is over budget.
+    global tts_cache_bytes, tts_cache_unchecked_bytes
+    size = os.path.getsize(temp_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(temp_path, path)
+    with tts_cache_lock:
+        if tts_cache_bytes is not None:
+            tts_cache_bytes += size
+            tts_cache_unchecked_bytes += size
+        if (tts_cache_bytes is None or tts_cache_bytes > TTS_CACHE_MAX_BYTES
+                or tts_cache_unchecked_bytes > TTS_CACHE_MAX_BYTES * 0.1):
+            tts_cache_bytes = evict_tts_cache()
+            tts_cache_unchecked_bytes = 0
+    return path
+
+
+def evict_tts_cache():
+    # Drops the least recently used files once the cache is over its byte budget; returns the cache size.
+    entries = []
+    total = 0
+    for root, _, names in os.walk(TTS_CACHE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    if total <= TTS_CACHE_MAX_BYTES:
+        return total
+    entries.sort()
+    for _, size, path in entries:
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+        if total <= TTS_CACHE_MAX_BYTES * 0.9:
+            break
+    return total
+
+
+def new_tts_temp_file(suffix):
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(suffix=suffix, dir=TTS_CACHE_DIR)
+    os.close(fd)
+    return temp_path
+
+
+def synthesize_with_gtts(text, verbose=True):
+    cache_path = tts_cache_path('gTTS', None, 'ja', text, '.mp3')
+    if tts_cache_lookup(cache_path):
+        metrics.count('tts_cache.hit')
+        return cache_path
+    metrics.count('tts_cache.miss')
+
+    temp_mp3 = None
+    try:
+        temp_mp3 = new_tts_temp_file('.mp3')
+        started = time.perf_counter()
+        for attempt in range(3):
+            try:
+                tts = gTTS(text=text, lang='ja')
+                tts.save(temp_mp3)
+                metrics.observe('synthesis.gTTS', time.perf_counter() - started)
+                return tts_cache_store(temp_mp3, cache_path)
+            except Exception as e:
+                if verbose:
+                    print(f"\n!! Online TTS connection failed (Attempt {attempt + 1}/3): {e}")
+                if attempt < 2:
+                    metrics.count('gTTS.retries')
+                    time.sleep(0.5)
+        metrics.count('gTTS.failures')
+        return None
+    finally:
+        if temp_mp3 and os.path.exists(temp_mp3):
+            try:
+                os.remove(temp_mp3)
+            except Exception as e:
+                print(f"!! Failed to clean up temporary file: {e}")
+
+
+def synthesize_with_pyttsx3(voice_id, text):
+    cache_path = tts_cache_path('pyttsx3', voice_id, 'ja', text, '.wav')
+    if tts_cache_lookup(cache_path):
+        metrics.count('tts_cache.hit')
+        return cache_path
+    metrics.count('tts_cache.miss')
+
+    temp_wav = new_tts_temp_file('.wav')
+    try:
+        started = time.perf_counter()
+        rendered = get_pyttsx3_worker().render(voice_id, text, temp_wav)
+        metrics.observe('synthesis.pyttsx3', time.perf_counter() - started)
+        if rendered and os.path.getsize(temp_wav) > 0:
+            return tts_cache_store(temp_wav, cache_path)
+        return None
+    finally:
+        if os.path.exists(temp_wav):
+            os.remove(temp_wav)
+
+
+class SpeechPrefetcher(threading.Thread):
+    # Synthesizes the audio of the next few cards into the TTS cache while the user is still thinking.
+    def __init__(self, synthesize, depth=PREFETCH_DEPTH):
+        super().__init__(daemon=True)
+        self.synthesize = synthesize
+        self.jobs = queue.Queue(maxsize=depth + 1)
+        self.generation = 0
+        self.finished = set()
+        self.in_progress = {}
+        self.lock = threading.Lock()
+
+    def schedule(self, texts):
+        # Replaces the pending work whenever the upcoming order is known again; stale jobs are dropped.
+        with self.lock:
+            self.generation += 1
+            while True:
+                try:
+                    self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+            for text in texts:
+                if not text or text in self.finished:
+                    continue
+                try:
+                    self.jobs.put_nowait((self.generation, text))
+                except queue.Full:
+                    break
+
+    def run(self):
+        while True:
+            generation, text = self.jobs.get()
+            if text is None:
+                break
+            with self.lock:
+                if generation != self.generation or text in self.finished or text in self.in_progress:
+                    continue
+                done = self.in_progress[text] = threading.Event()
+            try:
+                self.synthesize(text)
+            except Exception:
+                pass
+            finally:
+                with self.lock:
+                    self.finished.add(text)
+                    del self.in_progress[text]
+                done.set()
+
+    def wait_for(self, text, timeout=10.0):
+        # Lets a card that is being prefetched right now finish instead of synthesizing it twice.
+        with self.lock:
+            done = self.in_progress.get(text)
+        if done is not None:
+            done.wait(timeout)
+
+    def stop(self):
+        with self.lock:
+            self.generation += 1
+        self.jobs.put((None, None))
+
+
+speech_generation = 0
+# When the key press that asked for the speech being played was made (time.perf_counter()).
+speech_requested_at = None
+
+
+def record_speech_start(engine):
+    # Latency from the key press to the moment speech starts, per engine.
+    if speech_requested_at is not None:
+        metrics.observe(f'speech_start.{engine}', time.perf_counter() - speech_requested_at)
+
+
+def interrupt_speech():
+    # Invalidates the speech in flight: playback stops now, synthesis that finishes later is not played.
+    global speech_generation
+    speech_generation += 1
+    if pygame_available and pygame.mixer.get_init():
+        pygame.mixer.music.stop()
+    if pyttsx3_worker is not None:
+        pyttsx3_worker.cancel()
+
+
+def play_audio_file(path, generation):
+    if generation != speech_generation:
+        return
+    if pygame_available:
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        pygame.mixer.music.load(path)
+        pygame.mixer.music.play()
+        while pygame.mixer.music.get_busy() and generation == speech_generation:
+            time.sleep(0.02)
+    else:
+        playsound(path)
+
+
+def play_audio_bytes(data, suffix, generation):
+    if generation != speech_generation:
+        return
+    if pygame_available:
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        pygame.mixer.music.load(io.BytesIO(data), suffix.lstrip('.'))
+        pygame.mixer.music.play()
+        while pygame.mixer.music.get_busy() and generation == speech_generation:
+            time.sleep(0.02)
+    else:
+        # playsound needs a file; the TTS cache doubles as its scratch space.
+        path = tts_cache_path('pack', None, 'ja', hashlib.sha256(data).hexdigest(), suffix)
+        if not tts_cache_lookup(path):
+            temp_path = new_tts_temp_file(suffix)
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            tts_cache_store(temp_path, path)
+        playsound(path)
+
+
+class AudioPack:
+    # A single file of pre-rendered speech: header, audio blobs, then a JSON index of text -> (offset, length).
+    # The file is memory-mapped, so a lookup only touches the bytes of the clip being played.
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_offset, index_length = AUDIO_PACK_HEADER.unpack_from(self.map, 0)
+        if magic != AUDIO_PACK_MAGIC:
+            raise ValueError(f"'{path}' is not an audio pack.")
+        index = json.loads(self.map[index_offset:index_offset + index_length].decode('utf-8'))
+        self.engine = index['engine']
+        self.suffix = index['suffix']
+        self.entries = index['entries']
+
+    def __contains__(self, text):
+        return text in self.entries
+
+    def get(self, text):
+        entry = self.entries.get(text)
+        if entry is None:
+            return None
+        offset, length = entry
+        return self.map[offset:offset + length]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+def open_audio_pack(file_path):
+    pack_path = f"{file_path}.audiopack"
+    if not os.path.exists(pack_path):
+        return None
+    try:
+        pack = AudioPack(pack_path)
+        print(f"Using pre-rendered audio pack '{pack_path}' ({len(pack.entries)} clips, {pack.engine}).")
+        return pack
+    except Exception as e:
+        print(f"!! Could not open audio pack '{pack_path}': {e}")
+        return None
+
+
+def init_render_worker():
+    # Spawned worker processes start without the speech backends; forked ones inherit the parent's
+    # pyttsx3 worker object but not its thread, so each process starts a worker of its own.
+    # The TTS cache is counted afresh, since the lock may have been held by a thread when forking.
+    global pyttsx3_worker, tts_cache_bytes, tts_cache_unchecked_bytes, tts_cache_lock
+    pyttsx3_worker = None
+    tts_cache_bytes = None
+    tts_cache_unchecked_bytes = 0
+    tts_cache_lock = threading.Lock()
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Missing backends were already reported by the parent.
+        load_tts_backends()
+
+
+def render_speech(engine, voice_id, text):
+    # Runs in a worker process of prerender_audio_pack; the TTS cache is shared with study sessions.
+    if engine == 'gTTS':
+        path = synthesize_with_gtts(text)
+    else:
+        path = synthesize_with_pyttsx3(voice_id, text)
+    if path is None:
+        return text, None
+    with open(path, 'rb') as f:
+        return text, f.read()
+
+
+def prerender_audio_pack(file_path, engine='gTTS', workers=None):
+    load_tts_backends()
+    if engine == 'gTTS' and not gtts_available:
+        print("Error: gTTS is not installed, cannot pre-render online speech.")
+        return
+    voice_id = None
+    if engine == 'pyttsx3':
+        voice_id = get_pyttsx3_japanese_voice_id()
+        if not voice_id:
+            print("Error: No Japanese [Local] voice available, cannot pre-render offline speech.")
+            return
+
+    store = DeckStore(file_path)
+    try:
+        if store.is_stale():
+            store.import_workbook()
+        # Trimmed like card.speech, the key playback looks clips up by.
+        texts = [text for (text,) in store.conn.execute(f"SELECT DISTINCT {CARD_TEXT} FROM cards") if text]
+    finally:
+        store.close()
+    if not texts:
+        print("Nothing to render.")
+        return
+
+    workers = workers or os.cpu_count() or 1
+    if engine == 'gTTS':
+        # Every worker is one concurrent request to the online service.
+        workers = min(workers, GTTS_MAX_CONCURRENCY)
+    suffix = '.mp3' if engine == 'gTTS' else '.wav'
+    print(f"Rendering {len(texts)} clip(s) with {engine} using {workers} process(es)...")
+
+    pack_path = f"{file_path}.audiopack"
+    temp_path = f"{pack_path}.tmp"
+    entries = {}
+    failed = 0
+    with open(temp_path, 'wb') as out:
+        out.write(AUDIO_PACK_HEADER.pack(AUDIO_PACK_MAGIC, 0, 0))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_render_worker) as executor:
+            futures = [executor.submit(render_speech, engine, voice_id, text) for text in texts]
+            for done_count, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+                try:
+                    text, data = future.result()
+                except Exception as e:
+                    print(f"!! Rendering failed: {e}")
+                    failed += 1
+                    continue
+                if data is None:
+                    failed += 1
+                    continue
+                entries[text] = [out.tell(), len(data)]
+                out.write(data)
+                if done_count % 100 == 0:
+                    print(f"  {done_count}/{len(texts)}")
+        index = json.dumps({'engine': engine, 'suffix': suffix, 'entries': entries}, ensure_ascii=False).encode('utf-8')
+        index_offset = out.tell()
+        out.write(index)
+        out.seek(0)
+        out.write(AUDIO_PACK_HEADER.pack(AUDIO_PACK_MAGIC, index_offset, len(index)))
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temp_path, pack_path)
+    print(f"Audio pack written to '{pack_path}': {len(entries)} clip(s), {failed} failed.")
+
+
+class SpeechPlayer(threading.Thread):
+    # Speaks off the study loop. A new request cuts off whatever is still playing.
+    def __init__(self, speak):
+        super().__init__(daemon=True)
+        self.speak = speak
+        self.requests = queue.Queue()
+
+    def say(self, text, requested_at=None):
+        interrupt_speech()
+        self.requests.put((speech_generation, text, requested_at or time.perf_counter()))
+
+    def run(self):
+        global speech_requested_at
+        while True:
+            generation, text, requested_at = self.requests.get()
+            if text is None:
+                break
+            if generation != speech_generation:
+                continue
+            speech_requested_at = requested_at
+            try:
+                self.speak(text)
+            except Exception as e:
+                print(f"\n!! Error during speech playback: {e}")
+
+    def stop(self):
+        interrupt_speech()
+        self.requests.put((None, None, None))
+
+
+class KeyBuffer:
+    # Collects key presses in order, including those made while speech is still playing.
+    def __init__(self):
+        self.keys = queue.Queue()
+        self.hook = None
+        self.last_time = None
+
+    def start(self):
+        self.hook = keyboard.hook(self.on_event, suppress=True)
+
+    def on_event(self, event):
+        if event.event_type == keyboard.KEY_DOWN and event.name:
+            self.keys.put((event.name.lower(), time.perf_counter()))
+
+    def get(self):
+        # last_time is when the returned key was pressed, which may be well before it is read.
+        key, self.last_time = self.keys.get()
+        return key
+
+    def stop(self):
+        if self.hook is not None:
+            keyboard.unhook(self.hook)
+            self.hook = None
+
+
+def speak_with_gtts(text):
+    if not gtts_available or not text:
+        return False
+
+    try:
+        generation = speech_generation
+        audio_path = synthesize_with_gtts(text)
+        if audio_path:
+            record_speech_start('gTTS')
+            play_audio_file(audio_path, generation)
+        return audio_path is not None
+    except Exception as e:
+        print(f"\n!! An unknown error occurred during speech synthesis: {e}")
+        return False
+
+
+def speak_with_pyttsx3(voice_id, text):
+    if voice_id and text:
+        try:
+            generation = speech_generation
+            audio_path = synthesize_with_pyttsx3(voice_id, text) if audio_playback_available else None
+            if audio_path:
+                record_speech_start('pyttsx3')
+                play_audio_file(audio_path, generation)
+                return
+            if generation != speech_generation:
+                return
+            record_speech_start('pyttsx3')
+            get_pyttsx3_worker().say(voice_id, text)
+        except Exception as e:
+            metrics.count('pyttsx3.errors')
+            print(f"\n!! Error using local TTS: {e}")
+            # The cached voice may no longer exist; scan again on the next start.
+            forget_cached_voice_id()
+
+
+def get_display_length(s):
+    length = 0
+    for char in str(s):
+        if '\u4e00' <= char <= '\u9fff':
+            length += 2
+        else:
+            length += 1
+    return length
+
+def display_term(word, grammar, word_width=None, grammar_width=None):
+    # The widths, when given, are the precomputed display lengths of word and grammar.
+    print("\n" + "╔" + "═"*50 + "╗")
+    print("║" + " "*50 + "║")
+    
+    if word:
+        line = f"  [Word]: {word}"
+        padding = 50 - (get_display_length(line) if word_width is None else len("  [Word]: ") + word_width)
+        if padding < 0: padding = 0
+        print("║" + line + " "*padding + "║")
+        
+    if grammar:
+        line = f"  [Grammar]: {grammar}"
+        padding = 50 - (get_display_length(line) if grammar_width is None else len("  [Grammar]: ") + grammar_width)
+        if padding < 0: padding = 0
+        print("║" + line + " "*padding + "║")
+
+    print("║" + " "*50 + "║")
+    print("╚" + "═"*50 + "╝")
+
+def display_details(meaning, remarks, meaning_width=None, remarks_width=None):
+    if not meaning and not remarks:
+        return
+
+    print("╭" + "┈"*50 + "╮")
+    
+    if meaning:
+        line = f"  [Meaning]: {meaning}"
+        padding = 50 - (get_display_length(line) if meaning_width is None else len("  [Meaning]: ") + meaning_width)
+        if padding < 0: padding = 0
+        print("┆" + line + " "*padding + "┆")
+
+    if remarks:
+        line = f"  [Remarks]: {remarks}"
+        padding = 50 - (get_display_length(line) if remarks_width is None else len("  [Remarks]: ") + remarks_width)
+        if padding < 0: padding = 0
+        print("┆" + line + " "*padding + "┆")
+
+    print("╰" + "┈"*50 + "╯")
+
+
+def read_sheet_header(ws):
+    for header in ws.iter_rows(max_row=1, values_only=True):
+        return [str(name).strip() if name is not None else f"Unnamed: {i}" for i, name in enumerate(header)]
+    return []
+
+
+def iter_sheet_rows(ws, indices):
+    # Streams the data rows of a (read-only) worksheet as (Excel row number, values of the columns at
+    # indices), with None for an index that is None. Only the cells up to the last wanted column are
+    # parsed, and trailing rows without any wanted value are left out.
+    present = [index for index in indices if index is not None]
+    if not present:
+        return
+    empty_run = 0
+    rows = ws.iter_rows(min_row=2, max_col=max(present) + 1, values_only=True)
+    for row_number, row in enumerate(rows, start=2):
+        values = tuple(row[index] if index is not None and index < len(row) else None for index in indices)
+        if all(value is None for value in values):
+            empty_run += 1
+            continue
+        for empty_row in range(row_number - empty_run, row_number):
+            yield empty_row, (None,) * len(indices)
+        empty_run = 0
+        yield row_number, values
+
+
+def parse_fre(value):
+    # Anything that is not a number counts as 0, like pd.to_numeric(errors='coerce').fillna(0).
+    try:
+        return int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return 0
+
+
+def find_or_create_column(ws, name):
+    for cell in ws[1]:
+        if cell.value is not None and str(cell.value).strip() == name:
+            return cell.column
+    column = ws.max_column + 1
+    ws.cell(row=1, column=column).value = name
+    return column
+
+
+class FileLock:
+    # Advisory lock on a small side file. Sessions hold it while they read, merge and save a workbook
+    # (or append to its review log), so concurrent sessions take turns instead of overwriting each other.
+    def __init__(self, path, timeout=FILE_LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'a+b')
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    self.file.seek(0)
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+                return self
+            except OSError:
+                if time.monotonic() >= deadline:
+                    self.file.close()
+                    raise TimeoutError(f"'{self.path}' is still held by another session.")
+                time.sleep(0.05)
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+
+
+def save_workbook_atomically(book, file_path):
+    # Writes to a temporary file next to the target and swaps it in, so a crash never leaves a half-written xlsx.
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(prefix='.~', suffix='.xlsx', dir=directory)
+    os.close(fd)
+    try:
+        book.save(temp_path)
+        with open(temp_path, 'rb+') as f:
+            os.fsync(f.fileno())
+        # mkstemp creates the file readable by its owner only; the workbook keeps its own permissions.
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, temp_path)
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+MERGED_REVIEW_PROPERTY = 'StudyHelperMergedReviewId'
+EXPORT_INTERVAL = 30.0
+DECK_STORE_COLUMNS = {'单词': 'word', '文法': 'grammar', '读音': 'reading', '含义': 'meaning', '备注': 'remarks'}
+SCHEDULE_COLUMNS = {'due': 'REAL', 'ease': 'REAL', 'interval_days': 'REAL', 'reps': 'INTEGER'}
+SM2_DEFAULT_EASE = 2.5
+SM2_MIN_EASE = 1.3
+SM2_QUALITY = {'know': 4, 'forgot': 1}
+RELEARN_GAP = 3
+KANA_POOL_THRESHOLD = 20000
+KANA_POOL_CHUNK = 2000
+SQLITE_BATCH = 500
+SOURCE_BATCH = 500
+STARTUP_TARGET = 1.0
+# Results are stored by their index here: know, forgot, correct, undo.
+REVIEW_LOG_RESULTS = ('know', 'forgot', 'correct', 'undo')
+REVIEW_LOG_COLUMNS = {'time': 'f8', 'card': 'i4', 'result': 'i1', 'response': 'f4'}
+FORGETTING_CURVE_BINS = (0, 1 / 24, 6 / 24, 1, 3, 7, 28, 90, float('inf'))
+FORGETTING_CURVE_LABELS = ('<1h', '1-6h', '6-24h', '1-3d', '3-7d', '1-4w', '1-3mo', '>3mo')
+HARDEST_MIN_ANSWERS = 3
+
+# What card.speech holds: str.strip() also removes tabs, newlines and ideographic spaces, so TRIM gets the same set.
+STRIP_CHARS = "".join(map(chr, [*range(0x09, 0x0E), *range(0x1C, 0x21), 0x85, 0xA0, 0x1680, *range(0x2000, 0x200B),
+                                 0x2028, 0x2029, 0x202F, 0x205F, 0x3000]))
+CARD_TEXT = f"COALESCE(NULLIF(TRIM(word, '{STRIP_CHARS}'), ''), TRIM(grammar, '{STRIP_CHARS}'))"
+# Cards that have something to show, and the due (or never scheduled) ones of one sheet.
+CARD_HAS_CONTENT = f"COALESCE({CARD_TEXT}, '') != ''"
+DUE_CARDS_WHERE = f"sheet = ? AND (due IS NULL OR due <= ?) AND {CARD_HAS_CONTENT}"
+
+DECK_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS sheets (name TEXT PRIMARY KEY, position INTEGER NOT NULL, columns TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS cards (
+    sheet TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    word TEXT, grammar TEXT, reading TEXT, meaning TEXT, remarks TEXT,
+    fre INTEGER NOT NULL DEFAULT 0,
+    due REAL, ease REAL, interval_days REAL, reps INTEGER,
+    PRIMARY KEY (sheet, row)
+);
+CREATE TABLE IF NOT EXISTS reviews (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sheet TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    time REAL NOT NULL,
+    result TEXT NOT NULL,
+    delta INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reviews_card ON reviews (sheet, row);
+CREATE TABLE IF NOT EXISTS readings (surface TEXT PRIMARY KEY, hira TEXT NOT NULL);
+"""
+
+
+kakasi_instance = None
+kakasi_lock = threading.Lock()
+
+
+def get_kakasi():
+    # Loading the kakasi dictionaries takes most of a second, so it is done once per process,
+    # usually in the background while the deck is still loading.
+    global kakasi_instance
+    with kakasi_lock:
+        if kakasi_instance is None:
+            kakasi_instance = pykakasi.kakasi()
+        return kakasi_instance
+
+
+def convert_to_hiragana(words):
+    kks = get_kakasi()
+    readings = {}
+    for word in words:
+        try:
+            readings[word] = "".join([item['hira'] for item in kks.convert(word)])
+        except Exception as e:
+            print(f"!! Could not convert '{word}' to hiragana: {e}")
+    return readings
+
+
+def generate_readings(store, words):
+    # Readings are cached in the deck store by surface form; only words never seen before are converted,
+    # all at once at load time, and across processes for very large decks.
+    words = set(words)
+    readings = store.get_readings(words)
+    missing = sorted(words - readings.keys())
+    if not missing:
+        return readings
+    print(f"Generating readings for {len(missing)} word(s)...")
+    if len(missing) >= KANA_POOL_THRESHOLD:
+        chunks = [missing[i:i + KANA_POOL_CHUNK] for i in range(0, len(missing), KANA_POOL_CHUNK)]
+        new_readings = {}
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            for part in executor.map(convert_to_hiragana, chunks):
+                new_readings.update(part)
+    else:
+        new_readings = convert_to_hiragana(missing)
+    store.save_readings(new_readings)
+    readings.update(new_readings)
+    return readings
+
+
+def normalize_deck(df, readings):
+    # Turns the due cards into the session's card table with whole-column operations: text cleaned,
+    # rows without a word or grammar point dropped, the reading shown in place of missing remarks,
+    # and display widths computed (CJK ideographs count double, as in get_display_length).
+    # With readings=None no readings are shown at all.
+    def text(column):
+        if column not in df.columns:
+            return pd.Series("", index=df.index, dtype=object)
+        return df[column].fillna("").astype(str).str.strip()
+
+    cards = pd.DataFrame({'word': text('单词'), 'grammar': text('文法'), 'meaning': text('含义')}, index=df.index)
+    remarks = text('备注')
+    if readings is not None:
+        reading = text('读音')
+        if '单词' in df.columns:
+            reading = reading.where(reading != "", df['单词'].map(readings).fillna("").astype(str))
+        remarks = remarks.where(remarks != "", reading)
+    cards['remarks'] = remarks
+    cards['speech'] = cards['word'].where(cards['word'] != "", cards['grammar'])
+    for column in ('word', 'grammar', 'meaning', 'remarks'):
+        cards[f'{column}_width'] = cards[column].str.len() + cards[column].str.count('[\u4e00-\u9fff]')
+    cards['fre'] = df['Fre']
+    for column in SCHEDULE_COLUMNS:
+        cards[column] = df[column]
+    return cards[cards['speech'] != ""]
+
+
+class Card:
+    # One card of the session. row is its Excel row number and source the sheet it came from,
+    # which is all that is needed to write its progress back.
+    __slots__ = ('row', 'word', 'grammar', 'meaning', 'remarks', 'speech', 'word_width', 'grammar_width',
+                 'meaning_width', 'remarks_width', 'fre', 'due', 'ease', 'interval_days', 'reps', 'source')
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_table(cls, table, source):
+        # Built column by column from the normalized table, without a dict per row.
+        columns = [table[name].tolist() for name in cls.__slots__[1:-1]]
+        return [cls(*values, source) for values in zip(table.index.tolist(), *columns)]
+
+    def schedule(self):
+        return (self.due, self.ease, self.interval_days, self.reps)
+
+    def restore_schedule(self, schedule):
+        self.due, self.ease, self.interval_days, self.reps = schedule
+
+
+def schedule_answer(card, result, now):
+    # SM-2: updates the card's ease, interval and due time for an answer.
+    quality = SM2_QUALITY[result]
+    ease = max(SM2_MIN_EASE, card.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    if quality < 3:
+        reps = 0
+        interval_days = 0.0
+    else:
+        reps = card.reps + 1
+        if reps == 1:
+            interval_days = 1.0
+        elif reps == 2:
+            interval_days = 6.0
+        else:
+            interval_days = card.interval_days * ease
+    card.due = now + interval_days * 86400
+    card.ease = ease
+    card.interval_days = interval_days
+    card.reps = reps
+
+
+class StudyQueue:
+    # Due cards in priority order (due time, then -Fre), pulled lazily from a stream of positions that is
+    # already in that order; forgotten cards come back RELEARN_GAP answers later.
+    # total is the number of positions the stream will produce, used for the progress count.
+    def __init__(self, stream, total):
+        self.stream = iter(stream)
+        self.remaining = total
+        self.buffer = deque()
+        self.relearn = []
+        self.step = 0
+        self.counter = 0
+
+    def fill(self, k):
+        # Moves positions from the stream into the lookahead buffer until it holds k of them.
+        while len(self.buffer) < k and self.remaining > 0:
+            position = next(self.stream, None)
+            if position is None:
+                self.remaining = 0
+                break
+            self.remaining -= 1
+            self.buffer.append(position)
+        return len(self.buffer) >= k
+
+    def pop(self):
+        self.step += 1
+        if self.relearn and (self.relearn[0][0] <= self.step or not self.fill(1)):
+            return heapq.heappop(self.relearn)[2]
+        if self.fill(1):
+            return self.buffer.popleft()
+        return None
+
+    def upcoming(self, k):
+        # The next k positions pop() will return, reading at most k positions ahead in the stream.
+        self.fill(k)
+        relearn = sorted(self.relearn)
+        positions = []
+        step = self.step
+        r = b = 0
+        while len(positions) < k and (r < len(relearn) or b < len(self.buffer)):
+            step += 1
+            if r < len(relearn) and (relearn[r][0] <= step or b >= len(self.buffer)):
+                positions.append(relearn[r][2])
+                r += 1
+            else:
+                positions.append(self.buffer[b])
+                b += 1
+        return positions
+
+    def requeue(self, position, gap=RELEARN_GAP):
+        self.counter += 1
+        heapq.heappush(self.relearn, (self.step + gap, self.counter, position))
+
+    def push_front(self, position):
+        # Puts a position back at the head of the lookahead buffer, e.g. the card that was on screen
+        # when an earlier answer was undone.
+        self.buffer.appendleft(position)
+
+    def discard(self, position):
+        # Takes a requeued position back out of the relearn heap when the answer that requeued it is undone.
+        entries = [entry for entry in self.relearn if entry[2] != position]
+        if len(entries) != len(self.relearn):
+            self.relearn = entries
+            heapq.heapify(self.relearn)
+
+    def __len__(self):
+        return self.remaining + len(self.buffer) + len(self.relearn)
+
+
+# One answer of the session: the card's source and sheet row, 'know', 'forgot' or 'correct', the Fre delta,
+# and the card's schedule before and after the answer.
+AnswerEvent = namedtuple('AnswerEvent', ['source', 'row', 'result', 'delta', 'before', 'after'])
+
+
+class AnswerHistory:
+    # Undo and redo stacks of answer events. Any new answer clears the redo stack.
+    def __init__(self):
+        self.done = []
+        self.undone = []
+
+    def push(self, event):
+        self.done.append(event)
+        self.undone.clear()
+
+    def last(self):
+        return self.done[-1] if self.done else None
+
+    def undo(self):
+        if not self.done:
+            return None
+        event = self.done.pop()
+        self.undone.append(event)
+        return event
+
+    def redo(self):
+        if not self.undone:
+            return None
+        event = self.undone.pop()
+        self.done.append(event)
+        return event
+
+
+def read_merged_review_id(book):
+    # The id of the last review whose Fre delta is already contained in the workbook.
+    if MERGED_REVIEW_PROPERTY in book.custom_doc_props.names:
+        return int(book.custom_doc_props[MERGED_REVIEW_PROPERTY].value)
+    return 0
+
+
+def write_merged_review_id(book, review_id):
+    if MERGED_REVIEW_PROPERTY in book.custom_doc_props.names:
+        book.custom_doc_props[MERGED_REVIEW_PROPERTY].value = review_id
+    else:
+        book.custom_doc_props.append(IntProperty(name=MERGED_REVIEW_PROPERTY, value=review_id))
+
+
+def workbook_signature(file_path):
+    stat = os.stat(file_path)
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+class ReviewLog:
+    # Every answer as one fixed-width value per column file in <xlsx>.history/ (time, card, result and
+    # response seconds), only ever appended to, so analytics read years of history with one read per column.
+    # Card ids are handed out on first sight of a (sheet, row, text) and listed in cards.jsonl.
+    # Sessions on the same workbook append under a shared lock file.
+    def __init__(self, file_path):
+        self.path = f"{file_path}.history"
+        try:
+            os.mkdir(self.path)
+            self.created = True
+        except FileExistsError:
+            self.created = False
+        self.cards_path = os.path.join(self.path, 'cards.jsonl')
+        self.card_ids = {}
+        self.cards_size = -1
+        self.next_id = 0
+
+    def column_path(self, column):
+        return os.path.join(self.path, f"{column}.{REVIEW_LOG_COLUMNS[column]}")
+
+    def repair(self):
+        # A crash between the column writes leaves some columns an answer longer than the others;
+        # they are cut back before the next append so that later answers line up again.
+        lengths = {}
+        for column, code in REVIEW_LOG_COLUMNS.items():
+            path = self.column_path(column)
+            lengths[column] = os.path.getsize(path) // np.dtype(code).itemsize if os.path.exists(path) else 0
+        count = min(lengths.values())
+        for column, length in lengths.items():
+            if length > count:
+                os.truncate(self.column_path(column), count * np.dtype(REVIEW_LOG_COLUMNS[column]).itemsize)
+
+    def refresh_cards(self):
+        # Another session may have added cards since they were last read.
+        size = os.path.getsize(self.cards_path) if os.path.exists(self.cards_path) else 0
+        if size != self.cards_size:
+            self.card_ids = {(entry['sheet'], entry['row'], entry['text']): entry['id'] for entry in self.read_cards()}
+            self.next_id = max(self.card_ids.values(), default=-1) + 1
+            self.cards_size = size
+
+    def read_cards(self):
+        entries = []
+        if os.path.exists(self.cards_path):
+            with open(self.cards_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        return entries
+
+    def card_id(self, sheet, row, text):
+        key = (sheet, row, text)
+        if key not in self.card_ids:
+            self.card_ids[key] = self.next_id
+            self.next_id += 1
+            with open(self.cards_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'id': self.card_ids[key], 'sheet': sheet, 'row': row, 'text': text},
+                                   ensure_ascii=False) + "\n")
+                self.cards_size = f.tell()
+        return self.card_ids[key]
+
+    def append(self, answers):
+        # answers: (sheet, row, text, time, result, response seconds or None) tuples.
+        with FileLock(os.path.join(self.path, 'lock')):
+            self.repair()
+            self.refresh_cards()
+            columns = {column: [] for column in REVIEW_LOG_COLUMNS}
+            for sheet, row, text, when, result, response in answers:
+                if result not in REVIEW_LOG_RESULTS:
+                    continue
+                columns['time'].append(when)
+                columns['card'].append(self.card_id(sheet, row, text))
+                columns['result'].append(REVIEW_LOG_RESULTS.index(result))
+                columns['response'].append(np.nan if response is None else response)
+            if not columns['time']:
+                return
+            for column, values in columns.items():
+                with open(self.column_path(column), 'ab') as f:
+                    f.write(np.asarray(values, dtype='<' + REVIEW_LOG_COLUMNS[column]).tobytes())
+
+    def load(self):
+        # The answers as a DataFrame, plus the card id table (sheet, row, text) indexed by id.
+        arrays = {}
+        for column, code in REVIEW_LOG_COLUMNS.items():
+            dtype = np.dtype('<' + code)
+            data = b''
+            if os.path.exists(self.column_path(column)):
+                with open(self.column_path(column), 'rb') as f:
+                    data = f.read()
+            arrays[column] = np.frombuffer(data, dtype, len(data) // dtype.itemsize)
+        count = min(len(values) for values in arrays.values())
+        answers = pd.DataFrame({column: values[:count] for column, values in arrays.items()})
+        cards = pd.DataFrame(self.read_cards(), columns=['id', 'sheet', 'row', 'text']).drop_duplicates('id').set_index('id')
+        return answers, cards
+
+
+class DeckStore:
+    # Local SQLite copy of a workbook's cards, Fre counts and review history.
+    # The xlsx stays the source for card text; Fre deltas flow back to it through WorkbookExporter.
+    def __init__(self, file_path, check_same_thread=True):
+        self.file_path = file_path
+        self.path = f"{file_path}.deck.sqlite"
+        # Other sessions on the same workbook share this file; writers wait for each other instead of failing.
+        self.conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=check_same_thread)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(DECK_STORE_SCHEMA)
+        self.log = None
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(cards)")}
+        for column, declaration in SCHEDULE_COLUMNS.items():
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE cards ADD COLUMN {column} {declaration}")
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def is_stale(self):
+        return self.get_meta('signature') != workbook_signature(self.file_path)
+
+    def import_workbook(self):
+        # Rebuilds the cards from the workbook and re-applies answers it does not contain yet.
+        # Sheets are streamed in read-only mode and written SQLITE_BATCH rows at a time, reading only
+        # the columns the store keeps, so memory use does not grow with the length of a sheet.
+        # Each batch is its own transaction, so other sessions on this store can record answers
+        # while a large workbook is imported; the signature is only recorded once all sheets are in.
+        # Under the workbook lock, so the cards and the recorded signature come from the same save.
+        with FileLock(f"{self.file_path}.lock"):
+            book = load_workbook(self.file_path, read_only=True)
+            try:
+                marker = read_merged_review_id(book)
+                with self.conn:
+                    self.conn.execute("INSERT OR IGNORE INTO sqlite_sequence (name, seq) SELECT 'reviews', 0 "
+                                      "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'reviews')")
+                    self.conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'reviews'", (marker,))
+                    self.set_meta('marker', str(marker))
+                    self.set_meta('signature', None)
+
+                def write_cards(batch):
+                    # Pending deltas are read per batch, so they include answers recorded during the import.
+                    pending, _ = self.pending_deltas(marker)
+                    with self.conn:
+                        self.upsert_cards([(*row[:-1], row[-1] + pending.get((row[0], row[1]), 0)) for row in batch])
+
+                with self.conn:
+                    self.conn.execute("DELETE FROM sheets")
+                for position, name in enumerate(book.sheetnames):
+                    ws = book[name]
+                    header = read_sheet_header(ws)
+                    columns = [column for column in ['Fre', *DECK_STORE_COLUMNS] if column in header]
+                    with self.conn:
+                        self.conn.execute("INSERT INTO sheets (name, position, columns) VALUES (?, ?, ?)",
+                                          (name, position, json.dumps(columns, ensure_ascii=False)))
+                    indices = [header.index(column) if column in header else None for column in ['Fre', *DECK_STORE_COLUMNS]]
+                    last_row = 1
+                    batch = []
+                    for row, (fre, *texts) in iter_sheet_rows(ws, indices):
+                        batch.append((name, row, *[None if value is None else str(value) for value in texts], parse_fre(fre)))
+                        last_row = row
+                        if len(batch) >= SQLITE_BATCH:
+                            write_cards(batch)
+                            batch.clear()
+                    if batch:
+                        write_cards(batch)
+                    with self.conn:
+                        self.conn.execute("DELETE FROM cards WHERE sheet = ? AND row > ?", (name, last_row))
+                with self.conn:
+                    self.conn.execute("DELETE FROM cards WHERE sheet NOT IN (SELECT name FROM sheets)")
+                    self.set_meta('signature', workbook_signature(self.file_path))
+            finally:
+                book.close()
+
+    def upsert_cards(self, rows):
+        # Upsert so scheduling state survives re-imports; it is reset if the card's text changed.
+        self.conn.executemany(
+            "INSERT INTO cards (sheet, row, word, grammar, reading, meaning, remarks, fre) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (sheet, row) DO UPDATE SET "
+            "due = CASE WHEN word IS excluded.word AND grammar IS excluded.grammar THEN due END, "
+            "ease = CASE WHEN word IS excluded.word AND grammar IS excluded.grammar THEN ease END, "
+            "interval_days = CASE WHEN word IS excluded.word AND grammar IS excluded.grammar THEN interval_days END, "
+            "reps = CASE WHEN word IS excluded.word AND grammar IS excluded.grammar THEN reps END, "
+            "word = excluded.word, grammar = excluded.grammar, reading = excluded.reading, "
+            "meaning = excluded.meaning, remarks = excluded.remarks, fre = excluded.fre",
+            rows)
+
+    def sheet_names(self):
+        return [name for (name,) in self.conn.execute("SELECT name FROM sheets ORDER BY position")]
+
+    def sheet_columns(self, sheet):
+        row = self.conn.execute("SELECT columns FROM sheets WHERE name = ?", (sheet,)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def iter_due_cards(self, sheet, now, batch=SOURCE_BATCH):
+        # Cards that are due (or were never scheduled), most urgent first, as DataFrames of at most
+        # `batch` rows; only the rows the session reaches are ever turned into Python objects.
+        columns = self.sheet_columns(sheet)
+        keep = [column for column in DECK_STORE_COLUMNS if column in columns] + ['Fre', *SCHEDULE_COLUMNS]
+        cursor = self.conn.execute(
+            "SELECT row, word, grammar, reading, meaning, remarks, fre, COALESCE(due, 0), COALESCE(ease, ?), "
+            f"COALESCE(interval_days, 0), COALESCE(reps, 0) FROM cards WHERE {DUE_CARDS_WHERE} "
+            "ORDER BY COALESCE(due, 0), fre DESC, row",
+            (SM2_DEFAULT_EASE, sheet, now))
+        while True:
+            rows = cursor.fetchmany(batch)
+            if not rows:
+                return
+            df = pd.DataFrame(rows, columns=['row', *DECK_STORE_COLUMNS, 'Fre', *SCHEDULE_COLUMNS]).set_index('row')
+            df.index.name = None
+            yield df[keep]
+
+    def count_due_cards(self, sheet, now):
+        return self.conn.execute(f"SELECT COUNT(*) FROM cards WHERE {DUE_CARDS_WHERE}", (sheet, now)).fetchone()[0]
+
+    def sheet_summaries(self):
+        # Per sheet: card count, total and highest Fre, cards forgotten at least once, cards never
+        # scheduled, and scheduled cards counted per hour they fall due (hours since the epoch).
+        summaries = {name: {'cards': 0, 'fre_total': 0, 'fre_max': 0, 'forgotten': 0, 'new': 0, 'due_hours': {}}
+                     for name in self.sheet_names()}
+        for sheet, cards, fre_total, fre_max, forgotten, new in self.conn.execute(
+                "SELECT sheet, COUNT(*), COALESCE(SUM(fre), 0), COALESCE(MAX(fre), 0), SUM(fre > 0), SUM(due IS NULL) "
+                f"FROM cards WHERE {CARD_HAS_CONTENT} GROUP BY sheet"):
+            if sheet in summaries:
+                summaries[sheet].update(cards=cards, fre_total=fre_total, fre_max=fre_max, forgotten=forgotten, new=new)
+        for sheet, hour, count in self.conn.execute(
+                "SELECT sheet, CAST(due / 3600 AS INTEGER) AS hour, COUNT(*) FROM cards "
+                f"WHERE due IS NOT NULL AND {CARD_HAS_CONTENT} GROUP BY sheet, hour"):
+            if sheet in summaries:
+                summaries[sheet]['due_hours'][str(hour)] = count
+        return [{'sheet': name, **summary} for name, summary in summaries.items()]
+
+    def words_without_reading(self, sheet):
+        return [word for (word,) in self.conn.execute(
+            "SELECT DISTINCT word FROM cards WHERE sheet = ? AND word IS NOT NULL AND word != '' AND reading IS NULL",
+            (sheet,))]
+
+    def get_readings(self, words):
+        words = list(words)
+        readings = {}
+        for i in range(0, len(words), SQLITE_BATCH):
+            batch = words[i:i + SQLITE_BATCH]
+            placeholders = ", ".join("?" * len(batch))
+            readings.update(self.conn.execute(
+                f"SELECT surface, hira FROM readings WHERE surface IN ({placeholders})", batch).fetchall())
+        return readings
+
+    def save_readings(self, readings):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO readings (surface, hira) VALUES (?, ?)", readings.items())
+
+    def needs_readings(self):
+        return self.conn.execute(
+            "SELECT 1 FROM cards WHERE word IS NOT NULL AND word != '' AND reading IS NULL "
+            "AND word NOT IN (SELECT surface FROM readings) LIMIT 1").fetchone() is not None
+
+    def count_cards(self, sheet):
+        return self.conn.execute("SELECT COUNT(*) FROM cards WHERE sheet = ?", (sheet,)).fetchone()[0]
+
+    def review_log(self):
+        # Opened on first use. A new log starts out with the reviews already in the store, without response times.
+        if self.log is None:
+            self.log = ReviewLog(self.file_path)
+            if self.log.created:
+                self.log.append(self.conn.execute(
+                    f"SELECT r.sheet, r.row, {CARD_TEXT}, r.time, r.result, NULL FROM reviews r "
+                    "LEFT JOIN cards c ON c.sheet = r.sheet AND c.row = r.row ORDER BY r.id"))
+        return self.log
+
+    def card_text(self, sheet, row):
+        found = self.conn.execute(f"SELECT {CARD_TEXT} FROM cards WHERE sheet = ? AND row = ?", (sheet, row)).fetchone()
+        return found[0] if found else None
+
+    def record(self, sheet, row, result, delta, card=None, response=None):
+        now = time.time()
+        # Opened first, so a new log is not seeded with the review recorded here as well.
+        log = self.review_log()
+        with self.conn:
+            if delta:
+                self.conn.execute("UPDATE cards SET fre = fre + ? WHERE sheet = ? AND row = ?", (delta, sheet, row))
+            if card is not None:
+                self.conn.execute("UPDATE cards SET due = ?, ease = ?, interval_days = ?, reps = ? WHERE sheet = ? AND row = ?",
+                                  (*card.schedule(), sheet, row))
+            self.conn.execute("INSERT INTO reviews (sheet, row, time, result, delta) VALUES (?, ?, ?, ?, ?)",
+                              (sheet, row, now, result, delta))
+        text = card.speech if card is not None else self.card_text(sheet, row)
+        log.append([(sheet, row, text, now, result, response)])
+
+    def pending_deltas(self, marker):
+        # Fre changes from reviews newer than the workbook's marker, summed per card.
+        rows = self.conn.execute(
+            "SELECT sheet, row, SUM(delta) FROM reviews WHERE id > ? AND delta != 0 GROUP BY sheet, row",
+            (marker,)).fetchall()
+        last_id = self.conn.execute("SELECT MAX(id) FROM reviews").fetchone()[0] or 0
+        return {(sheet, row): delta for sheet, row, delta in rows}, last_id
+
+    def close(self):
+        self.conn.close()
+
+
+class WorkbookExporter(threading.Thread):
+    # Periodically merges pending Fre deltas from the deck store into the xlsx in the background,
+    # so the study loop never waits on a save.
+    def __init__(self, file_path, book=None, interval=EXPORT_INTERVAL):
+        super().__init__(daemon=True)
+        self.file_path = file_path
+        self.store = DeckStore(file_path, check_same_thread=False)
+        self.book = book
+        self.book_signature = workbook_signature(file_path) if book is not None else None
+        self.interval = interval
+        self.saves = 0
+        self.last_error = None
+        self.export_lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.wake_event.wait(self.interval)
+            self.wake_event.clear()
+            if self.stop_event.is_set():
+                break
+            try:
+                self.export()
+            except Exception as e:
+                # The answers stay pending in the store; the next export or the next session retries.
+                self.last_error = e
+                metrics.count('save.errors')
+
+    def export(self):
+        with self.export_lock:
+            # The marker recorded by the store avoids loading the workbook when nothing is pending.
+            if not self.store.pending_deltas(int(self.store.get_meta('marker', '0')))[0]:
+                return False
+            started = time.perf_counter()
+            # Another session may have saved since the workbook was loaded. Under the lock the file is
+            # checked again and reloaded if it changed, and the deltas are added to the counts on disk.
+            with FileLock(f"{self.file_path}.lock"):
+                signature = workbook_signature(self.file_path)
+                if self.book is None or signature != self.book_signature:
+                    self.book = load_workbook(self.file_path)
+                    self.book_signature = signature
+                marker = read_merged_review_id(self.book)
+                deltas, last_id = self.store.pending_deltas(marker)
+                if not deltas:
+                    return False
+                try:
+                    fre_columns = {}
+                    for (sheet, row), delta in deltas.items():
+                        if sheet not in self.book.sheetnames:
+                            continue
+                        ws = self.book[sheet]
+                        if sheet not in fre_columns:
+                            fre_columns[sheet] = find_or_create_column(ws, 'Fre')
+                        cell = ws.cell(row=row, column=fre_columns[sheet])
+                        current = pd.to_numeric(cell.value, errors='coerce')
+                        cell.value = (0 if pd.isna(current) else int(current)) + delta
+                    write_merged_review_id(self.book, last_id)
+                    save_workbook_atomically(self.book, self.file_path)
+                except Exception:
+                    # The in-memory workbook already holds the deltas; reload it from disk next time.
+                    self.book = None
+                    raise
+                self.book_signature = workbook_signature(self.file_path)
+                with self.store.conn:
+                    # Only skip the next import if the store already matched the file we merged into.
+                    if self.store.get_meta('signature') == signature:
+                        self.store.set_meta('signature', self.book_signature)
+                        self.store.set_meta('marker', str(last_id))
+            self.saves += 1
+            self.last_error = None
+            metrics.observe('save', time.perf_counter() - started)
+            return True
+
+    def wake(self):
+        self.wake_event.set()
+
+    def finish(self):
+        self.stop_event.set()
+        self.wake_event.set()
+        self.join()
+        try:
+            self.export()
+        finally:
+            self.store.close()
+        return self.saves > 0
+
+
+def deck_store_signature(file_path):
+    # The store changes without the workbook when answers that leave Fre alone are recorded.
+    parts = []
+    for path in (f"{file_path}.deck.sqlite", f"{file_path}.deck.sqlite-wal"):
+        parts.append(workbook_signature(path) if os.path.exists(path) else "-")
+    return "|".join(parts)
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_deck_catalog():
+    try:
+        with open(DECK_CATALOG_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_deck_catalog(catalog):
+    try:
+        with open(DECK_CATALOG_PATH, 'w', encoding='utf-8') as f:
+            json.dump(catalog, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        print(f"!! Could not write deck catalog '{DECK_CATALOG_PATH}': {e}")
+
+
+def catalog_entry(file_path, entry):
+    # Returns (entry, changed). The entry is reused while neither the workbook's mtime and size nor its deck
+    # store changed; a workbook that was only touched is recognized by its hash. Otherwise the sheets are
+    # summarized again from the deck store, which imports the workbook only if its content changed.
+    signature = workbook_signature(file_path)
+    store_signature = deck_store_signature(file_path)
+    if entry and entry['signature'] == signature and entry['store_signature'] == store_signature:
+        return entry, False
+    sha256 = file_sha256(file_path)
+    if entry and entry['sha256'] == sha256 and entry['store_signature'] == store_signature:
+        return {**entry, 'signature': signature}, True
+    print(f"Updating the deck catalog for '{file_path}'...")
+    store = DeckStore(file_path)
+    try:
+        if store.is_stale():
+            store.import_workbook()
+        sheets = store.sheet_summaries()
+    finally:
+        store.close()
+    return {'signature': workbook_signature(file_path), 'sha256': sha256,
+            'store_signature': deck_store_signature(file_path), 'sheets': sheets}, True
+
+
+def find_workbooks(paths):
+    workbooks = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                workbooks.extend(os.path.join(root, name) for name in sorted(files)
+                                 if name.endswith('.xlsx') and not name.startswith('~$'))
+        else:
+            workbooks.append(path)
+    return workbooks
+
+
+def refresh_deck_catalog(paths):
+    # The catalog entries of the given workbooks, rebuilt only where something changed.
+    catalog = load_deck_catalog()
+    changed = False
+    entries = []
+    for file_path in find_workbooks(paths):
+        key = os.path.abspath(file_path)
+        if not file_path.endswith('.xlsx') or not os.path.exists(file_path):
+            print(f"Skipping '{file_path}': not an existing .xlsx file.")
+            changed = catalog.pop(key, None) is not None or changed
+            continue
+        try:
+            entry, entry_changed = catalog_entry(file_path, catalog.get(key))
+        except Exception as e:
+            print(f"Skipping '{file_path}': {e}")
+            continue
+        catalog[key] = entry
+        changed = changed or entry_changed
+        entries.append((file_path, entry))
+    if changed:
+        save_deck_catalog(catalog)
+    return entries
+
+
+def due_now(summary, now):
+    hour = int(now // 3600)
+    return summary['new'] + sum(count for due_hour, count in summary['due_hours'].items() if int(due_hour) <= hour)
+
+
+class DeckSource:
+    # One worksheet taking part in a study session. Its due cards are read from the workbook's deck store
+    # a batch at a time in priority order, and answers go back to the same store and sheet.
+    def __init__(self, store, sheet, show_readings=True):
+        self.store = store
+        self.sheet = sheet
+        self.show_readings = show_readings
+        self.columns = store.sheet_columns(sheet)
+
+    def prepare(self):
+        # Readings the sheet does not provide are generated once, before the session starts,
+        # so that reading batches later on only looks them up.
+        if self.show_readings and '单词' in self.columns:
+            generate_readings(self.store, self.store.words_without_reading(self.sheet))
+
+    def count_due(self, now):
+        return self.store.count_due_cards(self.sheet, now)
+
+    def cards(self, now):
+        for df in self.store.iter_due_cards(self.sheet, now):
+            readings = None
+            if self.show_readings:
+                readings = {}
+                if '单词' in df.columns:
+                    words = df['单词'][df['单词'].notna()]
+                    if '读音' in df.columns:
+                        words = words[df['读音'].isna()]
+                    readings = self.store.get_readings(set(words))
+            yield from Card.from_table(normalize_deck(df, readings), self)
+
+    def record(self, card, result, delta, response=None):
+        self.store.record(self.sheet, card.row, result, delta, card, response)
+
+
+class StartupTimer:
+    # Time from launch to the first card on screen, split by stage. Time spent at the
+    # sheet prompt is the user's, not ours, so it is left out of the total.
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.stages = []
+        self.excluded = 0.0
+        self.reported = False
+
+    def mark(self, stage, excluded=False):
+        now = time.perf_counter()
+        if excluded:
+            self.excluded += now - self.last
+        else:
+            self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def report(self):
+        if self.reported:
+            return
+        self.reported = True
+        self.mark('session setup')
+        total = self.last - self.start - self.excluded
+        stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in self.stages if seconds >= 0.01)
+        print(f"[Startup] Time to first card: {total:.2f}s" + (f" ({stages})" if stages else ""))
+        if total > STARTUP_TARGET:
+            print(f"[Startup] That is over the {STARTUP_TARGET:.0f}s target.")
+
+
+def study_helper(file_path, sheet_to_study=None, tts_mode='auto', show_readings=True):
+    startup_timer = StartupTimer()
+    # Speech backends are imported and probed, and the kana dictionaries loaded, while the deck loads.
+    startup_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    voice_future = startup_pool.submit(probe_tts_backends)
+
+    store = None
+    chosen_sheet = None
+    try:
+        if not os.path.exists(file_path):
+            print(f"Error: File not found '{file_path}'.")
+            return
+
+        if not file_path.endswith('.xlsx'):
+            print(f"Error: This feature requires an .xlsx format Excel file.")
+            print(f"Please open '{os.path.basename(file_path)}' with Excel and save it as .xlsx format.")
+            return
+        
+        store = DeckStore(file_path)
+        stale = store.is_stale()
+        if show_readings and (stale or store.needs_readings()):
+            startup_pool.submit(get_kakasi)
+        startup_pool.shutdown(wait=False)
+        startup_timer.mark('deck store')
+        if stale:
+            print("Workbook changed since the last session, importing it into the local deck store...")
+            store.import_workbook()
+            startup_timer.mark('workbook import')
+        sheet_names = store.sheet_names()
+
+        if not sheet_names:
+            print("Error: No worksheets found in the Excel file.")
+            return
+
+        if sheet_to_study is not None:
+            if isinstance(sheet_to_study, int):
+                if 0 <= sheet_to_study < len(sheet_names):
+                    chosen_sheet = sheet_names[sheet_to_study]
+                else:
+                    print(f"Error: Specified sheet index {sheet_to_study} is invalid. Valid range is 0 to {len(sheet_names)-1}.")
+                    return
+            elif isinstance(sheet_to_study, str):
+                if sheet_to_study in sheet_names:
+                    chosen_sheet = sheet_to_study
+                else:
+                    print(f"Error: Cannot find worksheet named '{sheet_to_study}'.")
+                    print(f"Available worksheets are: {sheet_names}")
+                    return
+            else:
+                print("Error: Invalid type for sheet_to_study parameter. It should be an integer (index) or a string (name).")
+                return
+            print(f"Selected worksheet as specified: '{chosen_sheet}'")
+        else:
+            if len(sheet_names) == 1:
+                chosen_sheet = sheet_names[0]
+                print(f"Automatically selected the only worksheet: '{chosen_sheet}'")
+            else:
+                print("Multiple worksheets (Sheets) found:")
+                for i, name in enumerate(sheet_names):
+                    print(f"  {i+1}: {name}")
+                while True:
+                    try:
+                        choice = int(input(f"Please enter the number of the worksheet you want to study (1-{len(sheet_names)}): "))
+                        if 1 <= choice <= len(sheet_names):
+                            chosen_sheet = sheet_names[choice-1]
+                            break
+                        else:
+                            print("Invalid number, please try again.")
+                    except ValueError:
+                        print("Please enter a number.")
+                startup_timer.mark('sheet prompt', excluded=True)
+        
+        source = DeckSource(store, chosen_sheet, show_readings=show_readings)
+
+    except Exception as e:
+        print(f"Error reading or selecting worksheet: {e}")
+        return
+
+    if 'Fre' not in source.columns:
+        print("No 'Fre' column detected, creating it automatically.")
+
+    if '单词' not in source.columns and '文法' not in source.columns:
+        print(f"Error: Worksheet '{chosen_sheet}' must contain at least a '单词' or '文法' column.")
+        return
+        
+    if '读音' not in source.columns:
+        print("Info: No '读音' (Reading) column in your Excel. Readings will be auto-generated.")
+    if '含义' not in source.columns:
+        print("Info: No '含义' (Meaning) column in your Excel, definitions will not be shown.")
+    if '备注' not in source.columns:
+        print("Info: No '备注' (Remarks) column in your Excel, remarks will not be shown.")
+
+    source.prepare()
+    startup_timer.mark('readings')
+    run_session([source], tts_mode, voice_future, startup_timer)
+
+
+def study_session(decks, tts_mode='auto', show_readings=True):
+    # Studies several worksheets and workbooks as one session, most urgent cards first across all of them.
+    # Each entry of decks is a workbook path (all of its sheets) or a (workbook path, sheet name) pair.
+    startup_timer = StartupTimer()
+    startup_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    voice_future = startup_pool.submit(probe_tts_backends)
+    if show_readings:
+        startup_pool.submit(get_kakasi)
+    startup_pool.shutdown(wait=False)
+
+    stores = {}
+    sources = []
+    for deck in decks:
+        file_path, sheet = (deck, None) if isinstance(deck, str) else deck
+        if not file_path.endswith('.xlsx') or not os.path.exists(file_path):
+            print(f"Skipping '{file_path}': not an existing .xlsx file.")
+            continue
+        try:
+            if file_path not in stores:
+                store = DeckStore(file_path)
+                stores[file_path] = store
+                if store.is_stale():
+                    print(f"'{file_path}' changed since the last session, importing it into the local deck store...")
+                    store.import_workbook()
+            store = stores[file_path]
+            sheet_names = store.sheet_names()
+            for name in (sheet_names if sheet is None else [sheet]):
+                if name not in sheet_names:
+                    print(f"Skipping '{name}': no such worksheet in '{file_path}'.")
+                    continue
+                source = DeckSource(store, name, show_readings=show_readings)
+                if '单词' not in source.columns and '文法' not in source.columns:
+                    print(f"Skipping '{name}' in '{file_path}': it has no '单词' or '文法' column.")
+                    continue
+                source.prepare()
+                sources.append(source)
+        except Exception as e:
+            print(f"Skipping '{file_path}': {e}")
+    startup_timer.mark('deck stores')
+
+    if not sources:
+        print("Error: There is nothing to study.")
+        for store in stores.values():
+            store.close()
+        return
+    print(f"Studying {len(sources)} worksheet(s) from {len(stores)} workbook(s).")
+    run_session(sources, tts_mode, voice_future, startup_timer)
+
+
+def browse_decks(paths, tts_mode='auto', show_readings=True):
+    # Lists the worksheets of every workbook under paths from the deck catalog, then studies the chosen ones.
+    choices = []
+    now = time.time()
+    for file_path, entry in refresh_deck_catalog(paths):
+        for summary in entry['sheets']:
+            choices.append((file_path, summary))
+    if not choices:
+        print("Error: No workbooks found.")
+        return
+    print("Available worksheets:")
+    for i, (file_path, summary) in enumerate(choices):
+        print(f"  {i+1}: {file_path} / {summary['sheet']} - {summary['cards']} card(s), {due_now(summary, now)} due, "
+              f"Fre total {summary['fre_total']} (max {summary['fre_max']}, {summary['forgotten']} forgotten)")
+    while True:
+        answer = input("Enter the numbers of the worksheets to study (e.g. 1,3), or press Enter for all due ones: ").strip()
+        if not answer:
+            chosen = [i for i, (file_path, summary) in enumerate(choices) if due_now(summary, now)]
+            break
+        try:
+            chosen = [int(part) - 1 for part in answer.split(',')]
+        except ValueError:
+            print("Please enter numbers separated by commas.")
+            continue
+        if all(0 <= i < len(choices) for i in chosen):
+            break
+        print(f"Invalid number, please use 1-{len(choices)}.")
+    if not chosen:
+        print("Nothing is due for review right now. Come back later!")
+        return
+    study_session([(choices[i][0], choices[i][1]['sheet']) for i in chosen], tts_mode=tts_mode, show_readings=show_readings)
+
+
+def resolve_corrections(answers):
+    # Leaves only 'know' and 'forgot': 'correct' turns the card's previous answer into 'forgot' and
+    # 'undo' takes back the card's latest answer or correction. A correction or undo that directly
+    # follows an answer of its card applies to that answer; only cards with chains of them
+    # (undoing an undo, undoing a correction) are replayed one answer at a time.
+    know, forgot, correct, undo = range(len(REVIEW_LOG_RESULTS))
+    card = answers['card'].to_numpy()
+    result = answers['result'].to_numpy().copy()
+    keep = result <= forgot
+
+    # The answers of each card together, in log order.
+    order = np.argsort(card, kind='stable')
+    by_card = card[order]
+    special = ~keep[order]
+    follows_answer = np.r_[False, (by_card[1:] == by_card[:-1]) & ~special[:-1]]
+    chained = np.isin(card, by_card[special & ~follows_answer])
+    simple = special & follows_answer & ~chained[order]
+    targets = order[np.flatnonzero(simple) - 1]
+    codes = result[order[simple]]
+    keep[targets[codes == undo]] = False
+    result[targets[codes == correct]] = forgot
+
+    stacks = {}
+    for position in np.flatnonzero(chained).tolist():
+        # Entries are (position of the answer, result to restore on undo or None to drop it).
+        stack = stacks.setdefault(card[position], [])
+        if result[position] == undo:
+            if stack:
+                target, restore = stack.pop()
+                if restore is None:
+                    keep[target] = False
+                else:
+                    result[target] = restore
+        elif result[position] == correct:
+            if stack:
+                target = stack[-1][0]
+                stack.append((target, result[target]))
+                result[target] = forgot
+        else:
+            stack.append((position, None))
+    return answers.assign(result=result)[keep]
+
+
+def review_analytics(file_path, top=20):
+    # Retention, a forgetting curve and the hardest cards from the review log, in whole-column operations.
+    started = time.perf_counter()
+    store = DeckStore(file_path)
+    log = store.review_log()
+    store.close()
+    answers, cards = log.load()
+    answers = resolve_corrections(answers)
+    if answers.empty:
+        print("No answers recorded yet.")
+        return
+
+    answers = answers.sort_values(['card', 'time'], kind='stable')
+    answers['recalled'] = answers['result'] == REVIEW_LOG_RESULTS.index('know')
+    answers['lapsed'] = ~answers['recalled']
+    answers['gap_days'] = (answers['time'] - answers.groupby('card')['time'].shift()) / 86400
+    answers['sheet'] = cards['sheet'].reindex(answers['card']).to_numpy()
+    repeats = answers[answers['gap_days'].notna()]
+
+    print(f"{len(answers)} answers for {answers['card'].nunique()} cards, "
+          f"recalled {answers['recalled'].mean():.1%} of the time.")
+    responses = answers['response'].dropna()
+    if len(responses):
+        print(f"Median response time: {responses.median():.2f}s")
+
+    print("\nRetention by sheet:")
+    for sheet, row in answers.groupby('sheet')['recalled'].agg(['mean', 'size']).iterrows():
+        print(f"  {sheet}: {row['mean']:.1%} of {int(row['size'])} answers")
+
+    # Recall rate by the time since the same card was last answered, over all cards.
+    print("\nForgetting curve (recall by time since the card's previous answer):")
+    bins = pd.cut(repeats['gap_days'], FORGETTING_CURVE_BINS, labels=FORGETTING_CURVE_LABELS, right=False)
+    for label, row in repeats.groupby(bins, observed=True)['recalled'].agg(['mean', 'size']).iterrows():
+        print(f"  {label:>6}: {row['mean']:6.1%} of {int(row['size'])} answers")
+
+    # Each card's own curve as p = 2 ** (-gap / half_life), solved from its recall rate on repeat
+    # answers and their median gap; a card that is always or never recalled is clamped at 95% / 5%.
+    per_card = answers.groupby('card').agg(answers=('recalled', 'size'), lapses=('lapsed', 'sum'),
+                                           retention=('recalled', 'mean'))
+    curves = repeats.groupby('card').agg(recall=('recalled', 'mean'), gap=('gap_days', 'median'))
+    curves['half_life'] = curves['gap'] / -np.log2(curves['recall'].clip(0.05, 0.95))
+    per_card = per_card.join(curves['half_life']).join(cards)
+
+    hardest = per_card[per_card['answers'] >= HARDEST_MIN_ANSWERS].sort_values(
+        ['retention', 'lapses', 'half_life'], ascending=[True, False, True]).head(top)
+    print(f"\nHardest cards (at least {HARDEST_MIN_ANSWERS} answers):")
+    for card_id, row in hardest.iterrows():
+        half_life = "-" if pd.isna(row['half_life']) else f"{row['half_life']:.1f}d"
+        print(f"  {row['text']} ({row['sheet']} row {row['row']}): recalled {row['retention']:.0%} "
+              f"of {int(row['answers'])}, half-life {half_life}")
+    print(f"\nAnalyzed {len(answers)} answers in {time.perf_counter() - started:.2f}s.")
+
+
+def run_session(sources, tts_mode, voice_future, startup_timer):
+    # The study loop over the due cards of all sources, merged lazily into one stream by priority.
+    session_start = time.time()
+    stores = {source.store.file_path: source.store for source in sources}
+    total = sum(source.count_due(session_start) for source in sources)
+    if total == 0:
+        names = ", ".join(f"'{source.sheet}'" for source in sources)
+        print(f"\nNothing in {names} is due for review right now. Come back later!")
+        for store in stores.values():
+            store.close()
+        return
+    card_count = sum(source.store.count_cards(source.sheet) for source in sources)
+    print(f"\n{total} of {card_count} card(s) are due. The most forgotten items will appear first.")
+
+    japanese_voice_id = voice_future.result()
+    startup_timer.mark('speech backends')
+    auto_mode_current_engine = 'gTTS' if gtts_available else 'pyttsx3'
+
+    print("\n--- Japanese Study Helper Started ---")
+    if tts_mode == 'online':
+        print("[TTS Mode]: Online Only")
+    elif tts_mode == 'offline':
+        print("[TTS Mode]: Offline Only")
+    else:
+        print("[TTS Mode]: Auto (Online first, fallback to Offline)")
+        
+    print("[IMPORTANT] Please make sure your input method is in English mode to ensure key presses are registered correctly.")
+    
+    metrics.reset()
+    metrics_server = None
+    if os.environ.get('STUDY_METRICS_PORT'):
+        try:
+            metrics_server = serve_metrics(int(os.environ['STUDY_METRICS_PORT']))
+            print(f"[Metrics]: http://127.0.0.1:{metrics_server.server_port}/metrics")
+        except (OSError, ValueError) as e:
+            print(f"!! Could not serve metrics: {e}")
+
+    exporters = [WorkbookExporter(file_path) for file_path in stores]
+    for exporter in exporters:
+        exporter.start()
+        exporter.wake()
+    history = AnswerHistory()
+    cards = []
+    positions = {}
+
+    def take(card):
+        # Cards get their position, and their (source, row) entry in the index, as the stream reaches them.
+        positions[(card.source, card.row)] = len(cards)
+        cards.append(card)
+        return len(cards) - 1
+
+    merged = heapq.merge(*(source.cards(session_start) for source in sources), key=lambda card: (card.due, -card.fre))
+    study_queue = StudyQueue(map(take, merged), total)
+
+    def speech_text(position):
+        return cards[position].speech
+
+    audio_packs = [pack for pack in map(open_audio_pack, stores) if pack is not None]
+
+    def packed_audio(text):
+        return next((pack for pack in audio_packs if text in pack), None)
+
+    def prefetch_audio(text):
+        if packed_audio(text) is not None:
+            return
+        engine = {'online': 'gTTS', 'offline': 'pyttsx3'}.get(tts_mode, auto_mode_current_engine)
+        if engine == 'gTTS' and gtts_available:
+            synthesize_with_gtts(text, verbose=False)
+        elif engine == 'pyttsx3' and japanese_voice_id and audio_playback_available:
+            synthesize_with_pyttsx3(japanese_voice_id, text)
+
+    prefetcher = SpeechPrefetcher(prefetch_audio)
+    prefetcher.start()
+
+    def speak(text_to_speak):
+        audio_pack = packed_audio(text_to_speak)
+        if audio_pack is not None:
+            record_speech_start('audiopack')
+            play_audio_bytes(audio_pack.get(text_to_speak), audio_pack.suffix, speech_generation)
+            return
+        prefetcher.wait_for(text_to_speak)
+        if tts_mode == 'online':
+            if not speak_with_gtts(text_to_speak):
+                print("\n!! Online TTS failed.")
+            return
+
+        if tts_mode == 'offline':
+            if japanese_voice_id:
+                speak_with_pyttsx3(japanese_voice_id, text_to_speak)
+            else:
+                print("\n!! Offline TTS is not available.")
+            return
+            
+        nonlocal auto_mode_current_engine
+        if auto_mode_current_engine == 'gTTS':
+            if not speak_with_gtts(text_to_speak):
+                print("\n!! Online TTS failed, automatically switching to [Offline TTS] mode.")
+                metrics.count('tts.fallback_to_pyttsx3')
+                auto_mode_current_engine = 'pyttsx3'
+                speak_with_pyttsx3(japanese_voice_id, text_to_speak)
+        elif auto_mode_current_engine == 'pyttsx3':
+            speak_with_pyttsx3(japanese_voice_id, text_to_speak)
+
+    unrecorded = deque()
+
+    def record(card, result, delta, response=None):
+        # Another session writing to the same deck store can still outlast the busy timeout. An answer
+        # that could not be recorded is kept, in order, and retried with the next one and at the end.
+        unrecorded.append((card, result, delta, response))
+        return record_pending()
+
+    def record_pending():
+        while unrecorded:
+            card, result, delta, response = unrecorded[0]
+            try:
+                card.source.record(card, result, delta, response)
+            except sqlite3.OperationalError as e:
+                metrics.count('record.errors')
+                print(f"\n!! Could not record the answer yet, it will be retried: {e}")
+                return False
+            unrecorded.popleft()
+        return True
+
+    speech_player = SpeechPlayer(speak)
+    speech_player.start()
+    key_buffer = KeyBuffer()
+    key_buffer.start()
+
+    answered = 0
+    key_read_at = None
+    i = study_queue.pop()
+    while i is not None:
+        card = cards[i]
+
+        startup_timer.report()
+        display_term(card.word, card.grammar, card.word_width, card.grammar_width)
+        shown_at = time.perf_counter()
+        if key_read_at is not None:
+            # From reading the previous key to this card on screen: the loop's own overhead.
+            metrics.observe('card_turnaround', shown_at - key_read_at)
+        prefetcher.schedule([card.speech] + [speech_text(position) for position in study_queue.upcoming(PREFETCH_DEPTH)])
+
+        prompt = "Press a key... (→: Know / 0: Don't Know / q: Quit"
+        last_event = history.last()
+        if last_event is not None and last_event.result == 'know':
+            prompt += " / x: Correct Last"
+        if history.done:
+            prompt += " / u: Undo"
+        if history.undone:
+            prompt += " / r: Redo"
+        prompt += ")"
+
+        print(prompt + " " + str(answered+1) + "/" + str(answered+len(study_queue)+1))
+        
+        key = key_buffer.get()
+        key_read_at = time.perf_counter()
+        key_time = key_buffer.last_time or key_read_at
+        
+        if key == 'q':
+            speech_player.stop()
+            print("Saving progress and exiting...")
+            break 
+        
+        if key == 'x':
+            last_event = history.last()
+            if last_event is not None and last_event.result == 'know':
+                position = positions[(last_event.source, last_event.row)]
+                last_card = cards[position]
+                before = last_card.schedule()
+                last_card.fre += 1
+                # Undo the 'know' scheduling and treat the card as forgotten instead.
+                last_card.restore_schedule(last_event.before)
+                schedule_answer(last_card, 'forgot', time.time())
+                study_queue.requeue(position)
+                record(last_card, 'correct', 1)
+                history.push(AnswerEvent(last_card.source, last_card.row, 'correct', 1, before, last_card.schedule()))
+                metrics.count('answers.correct')
+                print(f"\nCorrected the previous item!")
+            else:
+                print("\nThere is no previous item to correct.")
+            continue
+
+        if key == 'u':
+            event = history.undo()
+            if event is None:
+                print("\nThere is nothing to undo.")
+                continue
+            position = positions[(event.source, event.row)]
+            undone_card = cards[position]
+            undone_card.fre -= event.delta
+            undone_card.restore_schedule(event.before)
+            study_queue.discard(position)
+            record(undone_card, 'undo', -event.delta)
+            metrics.count('answers.undo')
+            print(f"\nUndid '{event.result}' for '{undone_card.speech}'.")
+            if event.result != 'correct':
+                # The card is asked again right away; the one on screen comes after it.
+                if position != i:
+                    study_queue.push_front(i)
+                i = position
+                answered -= 1
+            continue
+
+        if key == 'r':
+            event = history.redo()
+            if event is None:
+                print("\nThere is nothing to redo.")
+                continue
+            position = positions[(event.source, event.row)]
+            redone_card = cards[position]
+            redone_card.fre += event.delta
+            redone_card.restore_schedule(event.after)
+            if event.result != 'know':
+                study_queue.requeue(position)
+            record(redone_card, event.result, event.delta)
+            metrics.count('answers.redo')
+            print(f"\nRedid '{event.result}' for '{redone_card.speech}'.")
+            if event.result != 'correct':
+                # Undoing this answer brought its card back on screen; redoing it moves on again.
+                answered += 1
+                i = study_queue.pop()
+            continue
+
+        text_to_speak = card.speech
+        details = (card.meaning, card.remarks, card.meaning_width, card.remarks_width)
+
+        if key in ('0', 'right'):
+            # Keys typed ahead count as an instant answer.
+            response = max(0.0, key_time - shown_at)
+            metrics.observe('response', response)
+            metrics.count('answers.forgot' if key == '0' else 'answers.know')
+
+        if key == '0':
+            before = card.schedule()
+            card.fre += 1
+            schedule_answer(card, 'forgot', time.time())
+            record(card, 'forgot', 1, response)
+            history.push(AnswerEvent(card.source, card.row, 'forgot', 1, before, card.schedule()))
+            study_queue.requeue(i)
+            print(f"Recorded! Forgotten count: {card.fre}")
+            display_details(*details)
+            speech_player.say(text_to_speak, key_time)
+
+        elif key == 'right':
+            display_details(*details)
+            speech_player.say(text_to_speak, key_time)
+
+            print(f"Great! Forgotten count: {card.fre}")
+            before = card.schedule()
+            schedule_answer(card, 'know', time.time())
+            record(card, 'know', 0, response)
+            history.push(AnswerEvent(card.source, card.row, 'know', 0, before, card.schedule()))
+
+        answered += 1
+        i = study_queue.pop()
+
+    key_buffer.stop()
+    speech_player.stop()
+    prefetcher.stop()
+    if audio_packs:
+        speech_player.join(1.0)
+        for audio_pack in audio_packs:
+            audio_pack.close()
+    print("\nAll words/grammar have been studied!")
+
+    print("Saving progress and preserving column widths...")
+    saved = False
+    failed = False
+    if not record_pending():
+        failed = True
+        print(f"!! {len(unrecorded)} answer(s) could not be recorded and are lost.")
+    for exporter in exporters:
+        store_path = stores[exporter.file_path].path
+        try:
+            saved = exporter.finish() or saved
+        except PermissionError:
+            failed = True
+            metrics.count('save.errors')
+            print(f"\nError saving file: Permission denied. Please close the Excel file '{exporter.file_path}'.")
+            print(f"Your answers are kept in '{store_path}' and will be applied the next time you start.")
+        except TimeoutError:
+            failed = True
+            metrics.count('save.errors')
+            print(f"\nAnother session is still saving '{exporter.file_path}'.")
+            print(f"Your answers are kept in '{store_path}' and will be applied the next time you start.")
+        except Exception as e:
+            failed = True
+            metrics.count('save.errors')
+            print(f"\nAn unknown error occurred while saving '{exporter.file_path}': {e}")
+            print(f"Your answers are kept in '{store_path}' and will be applied the next time you start.")
+    for store in stores.values():
+        store.close()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    metrics.write(script=os.path.basename(sys.argv[0]), tts_mode=tts_mode,
+                  decks=[f"{source.store.file_path}#{source.sheet}" for source in sources])
+    if saved and not failed:
+        print("\nStudy session finished! Your progress has been saved successfully, and column widths are preserved.")
+    elif not saved and not failed:
+        print("\nNo changes were made, no need to save.")
+
+
+def run_cli(excel_file_path, study_sheet=0, preferred_tts_engine='offline', show_readings=True):
+    # Dispatches the command line of an entry script; with no command the default sheet is studied.
+    if len(sys.argv) > 1 and sys.argv[1] == 'prerender':
+        # python <script> prerender [gTTS|pyttsx3]: render every entry once into <workbook>.audiopack
+        prerender_audio_pack(excel_file_path, engine=sys.argv[2] if len(sys.argv) > 2 else 'gTTS')
+    elif len(sys.argv) > 1 and sys.argv[1] == 'decks':
+        # python <script> decks [<workbook or folder> ...]: list worksheets from the deck catalog and pick some to study
+        browse_decks(sys.argv[2:] or [os.path.dirname(excel_file_path) or '.'], tts_mode=preferred_tts_engine,
+                     show_readings=show_readings)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'stats':
+        # python <script> stats [<count>]: retention, forgetting curve and the hardest cards from the review log
+        review_analytics(excel_file_path, top=int(sys.argv[2]) if len(sys.argv) > 2 else 20)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'mix':
+        # python <script> mix <workbook>[#<sheet>] ...: study several sheets and workbooks in one session
+        decks = [tuple(arg.rsplit('#', 1)) if '#' in arg else arg for arg in sys.argv[2:]]
+        study_session(decks or [excel_file_path], tts_mode=preferred_tts_engine, show_readings=show_readings)
+    else:
+        study_helper(excel_file_path, sheet_to_study=study_sheet, tts_mode=preferred_tts_engine,
+                     show_readings=show_readings)